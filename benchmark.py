@@ -0,0 +1,362 @@
+"""
+Offline benchmarks for NEETIQBot hot paths.
+
+Everything runs against a throwaway local file, never the Turso database:
+    python benchmark.py                          # all benchmarks
+    python benchmark.py is_admin ranks           # just some
+    python benchmark.py --json run.json          # also write machine-readable results
+    python benchmark.py --compare base.json      # exit 1 on regressions against a saved run
+    BENCH_SCALE=0.1 python benchmark.py          # smaller dataset for a quick check
+    DB_BACKEND=sqlite python benchmark.py        # the local SQLite WAL backend instead of libsql
+The data benchmarks seed a realistic dataset first (100k users, 5k groups, 100k
+questions at scale 1). Local file queries have no network round trip, so "before"
+numbers here are a lower bound of what the same query costs against Turso.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+import statistics
+from datetime import datetime
+from types import SimpleNamespace
+
+# Point the database module at a local file BEFORE importing it
+BENCH_DIR = tempfile.mkdtemp(prefix="neetiq-bench-")
+os.environ["TURSO_URL"] = f"file:{os.path.join(BENCH_DIR, 'bench.db')}"
+os.environ["TURSO_TOKEN"] = "benchmark"
+os.environ["SQLITE_PATH"] = os.path.join(BENCH_DIR, 'bench.db')
+
+import database as db
+
+# --- DATASET SIZE ---
+BENCH_SCALE = float(os.environ.get("BENCH_SCALE", "1"))
+BENCH_USERS = 100_000
+BENCH_GROUPS = 5_000
+BENCH_QUESTIONS = 100_000
+BENCH_GROUPS_PER_USER = 2
+# Rows per multi-row insert / insert statements per seeding round trip
+SEED_CHUNK = 100
+SEED_STATEMENTS = 50
+
+# name -> figures, written by --json
+RESULTS = {}
+
+
+def summarize(samples):
+    """Latency figures (microseconds) for a list of per-call samples."""
+    samples = sorted(samples)
+    return {
+        'iterations': len(samples),
+        'mean_us': statistics.fmean(samples),
+        'p50_us': samples[len(samples) // 2],
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+def measure(func, iterations):
+    """Calls func() `iterations` times and returns latency figures in microseconds."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        func()
+        samples.append((time.perf_counter_ns() - start) / 1000)
+    return summarize(samples)
+
+def measure_async(make_coro, iterations):
+    """Same as measure() but for coroutines, timed inside one running event loop."""
+    async def runner():
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter_ns()
+            await make_coro()
+            samples.append((time.perf_counter_ns() - start) / 1000)
+        return samples
+    return summarize(asyncio.run(runner()))
+
+def report(name, result):
+    RESULTS[name] = result
+    print(f"{name:<40} mean {result['mean_us']:>10.1f} µs | p50 {result['p50_us']:>10.1f} µs | p99 {result['p99_us']:>10.1f} µs")
+
+
+# ---------------- DATASET ----------------
+
+_dataset = None
+
+def scaled(count):
+    return max(1, int(count * BENCH_SCALE))
+
+def bulk_insert(table, columns, rows):
+    """Seeds a table with multi-row inserts, SEED_STATEMENTS of them per round trip."""
+    template = "(" + ", ".join("?" * len(columns)) + ")"
+    statements = [(
+        f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([template] * len(chunk)),
+        [v for row in chunk for v in row]
+    ) for chunk in db._chunks(rows, SEED_CHUNK)]
+    with db.get_db() as conn:
+        for i in range(0, len(statements), SEED_STATEMENTS):
+            conn.batch(statements[i:i + SEED_STATEMENTS])
+
+def dataset():
+    """Seeds users, groups, stats and questions once per run. Returns (user_ids, group_ids)."""
+    global _dataset
+    if _dataset is not None:
+        return _dataset
+    rng = random.Random(42)
+    users, groups, questions = scaled(BENCH_USERS), scaled(BENCH_GROUPS), scaled(BENCH_QUESTIONS)
+    user_ids = list(range(1_000_000, 1_000_000 + users))
+    group_ids = list(range(-1_000_000_000, -1_000_000_000 + groups))
+
+    start = time.perf_counter()
+    bulk_insert("users", ("user_id", "username", "first_name", "joined_at"),
+                [(u, f"user{u}" if u % 3 else None, f"User {u}", "2024-01-01") for u in user_ids])
+    bulk_insert("chats", ("chat_id", "type", "title", "added_at"),
+                [(g, "supergroup", f"Group {g}", "2024-01-01") for g in group_ids])
+    stats, group_stats = [], []
+    for u in user_ids:
+        attempted = rng.randint(1, 500)
+        correct = rng.randint(0, attempted)
+        stats.append((u, attempted, correct, correct * 4 - (attempted - correct), 0, rng.randint(0, 30)))
+        for g in rng.sample(group_ids, min(BENCH_GROUPS_PER_USER, len(group_ids))):
+            g_att = rng.randint(1, attempted)
+            g_corr = min(correct, rng.randint(0, g_att))
+            group_stats.append((g, u, g_corr * 4 - (g_att - g_corr), g_att, g_corr))
+    bulk_insert("stats", ("user_id", "attempted", "correct", "score", "current_streak", "max_streak"), stats)
+    bulk_insert("group_stats", ("chat_id", "user_id", "score", "attempted", "correct"), group_stats)
+    bulk_insert("questions", ("question", "a", "b", "c", "d", "correct", "explanation"),
+                [(f"Question {i}?", "A1", "B1", "C1", "D1", "ABCD"[i % 4], f"Because {i}") for i in range(questions)])
+    print(f"🌱 Seeded {users} users, {groups} groups, {len(group_stats)} group rows, "
+          f"{questions} questions in {time.perf_counter() - start:.1f}s")
+
+    _dataset = (user_ids, group_ids)
+    return _dataset
+
+
+# ---------------- BENCHMARKS ----------------
+
+def bench_is_admin(iterations=2000):
+    """Per-command authorization cost: admins table query vs cached admin set."""
+    with db.get_db() as conn:
+        conn.executemany("INSERT OR IGNORE INTO admins (user_id, added_at) VALUES (?,?)",
+                         [(1000 + i, 'bench') for i in range(50)])
+    db.admins.load()
+    user_id = 1025
+
+    before = measure_async(lambda: db.fetchone("SELECT 1 FROM admins WHERE user_id=?", (user_id,)), iterations)
+    after = measure(lambda: user_id in db.admins, iterations)
+    report("is_admin before (query per check)", before)
+    report("is_admin after (cached set)", after)
+
+def bench_init_db(iterations=10):
+    """Startup schema check against a populated database."""
+    dataset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = measure(db.init_db, iterations)
+    report("init_db", result)
+
+def bench_update_user_stats(answers=100_000):
+    """Poll-answer throughput: buffered update_user_stats plus the bulk flushes it triggers."""
+    user_ids, group_ids = dataset()
+    db.load_ranks()
+    rng = random.Random(7)
+    answers = scaled(answers)
+    picks = [(rng.choice(user_ids), rng.choice(group_ids), rng.random() < 0.6) for _ in range(answers)]
+
+    flush_samples = []
+    start = time.perf_counter()
+    for user_id, chat_id, is_correct in picks:
+        if db.update_user_stats(user_id, chat_id, is_correct):
+            flush_start = time.perf_counter_ns()
+            db.flush_stats()
+            flush_samples.append((time.perf_counter_ns() - flush_start) / 1000)
+    db.flush_stats()
+    elapsed = time.perf_counter() - start
+
+    RESULTS["update_user_stats"] = {
+        'answers': answers,
+        'answers_per_s': answers / elapsed,
+        'flushes': len(flush_samples),
+        'flush_mean_us': statistics.fmean(flush_samples) if flush_samples else 0.0,
+    }
+    print(f"{'update_user_stats':<40} {answers / elapsed:>10.0f} answers/s | "
+          f"{len(flush_samples)} flushes, mean {RESULTS['update_user_stats']['flush_mean_us'] / 1000:.1f} ms")
+
+def bench_leaderboard(iterations=200):
+    """Leaderboard queries: global top 10 and a random group's top 10."""
+    _, group_ids = dataset()
+    rng = random.Random(11)
+    report("get_leaderboard_data global", measure(lambda: db.get_leaderboard_data(limit=10), iterations))
+    report("get_leaderboard_data group",
+           measure(lambda: db.get_leaderboard_data(chat_id=rng.choice(group_ids), limit=10), iterations))
+
+def bench_ranks(iterations=1000):
+    """myscore/mystats ranks: COUNT(*) queries vs the in-memory rank indexes."""
+    user_ids, group_ids = dataset()
+    db.load_ranks()
+    with db.get_db() as conn:
+        members = [(r[0], r[1]) for r in conn.execute("SELECT chat_id, user_id FROM group_stats LIMIT 10000").fetchall()]
+    rng = random.Random(13)
+
+    def global_query():
+        with db.get_db() as conn:
+            conn.execute("SELECT COUNT(*) + 1 FROM stats WHERE score > (SELECT score FROM stats WHERE user_id = ?)",
+                         (rng.choice(user_ids),))
+
+    def group_query():
+        chat_id, user_id = rng.choice(members)
+        with db.get_db() as conn:
+            conn.execute("SELECT COUNT(*) + 1 FROM group_stats WHERE chat_id = ? AND score > "
+                         "(SELECT score FROM group_stats WHERE chat_id = ? AND user_id = ?)", (chat_id, chat_id, user_id))
+
+    report("global rank before (COUNT query)", measure(global_query, iterations))
+    report("global rank after (rank index)", measure(lambda: db.global_ranks.rank_of(rng.choice(user_ids)), iterations))
+    report("group rank before (COUNT query)", measure(group_query, iterations))
+    report("group rank after (rank index)", measure(lambda: db.group_ranks.rank_of(*rng.choice(members)), iterations))
+
+def bench_random_question(iterations=500):
+    """Random question selection: ORDER BY RANDOM() scan vs the question pool's key seeks."""
+    dataset()
+
+    def order_by_random():
+        with db.get_db() as conn:
+            conn.execute("SELECT * FROM questions ORDER BY RANDOM() LIMIT 1").fetchone()
+
+    claimed = []
+    report("random question before (ORDER BY RANDOM)", measure(order_by_random, iterations))
+    report("random question after (question pool)", measure(lambda: claimed.append(db.question_pool.pop()), iterations))
+    # pop() deletes what it claims; put the bank back for the next benchmark
+    db.insert_questions([tuple(q)[1:] for q in claimed if q])
+
+
+class LegacyRowWrapper:
+    """The row class the DB layer used before database.Row (kept here as the baseline)."""
+    def __init__(self, row, columns):
+        self.row = row
+        self.columns = columns
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.row[self.columns.index(key)]
+        return self.row[key]
+    def __iter__(self):
+        return iter(self.row)
+
+def profile_rows(wrap, res):
+    """(seconds to wrap, bytes allocated by the wrapped rows, seconds for one by-name lookup per row)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = wrap(res)
+    built = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for r in rows:
+        r['explanation']
+    return built, allocated, time.perf_counter() - start
+
+def lazy_rows(res):
+    """Same wrapping TursoCursor.iterate does."""
+    index = db.column_index(res.columns)
+    return (db.Row(row, index) for row in res.rows)
+
+def bench_rows(count=100_000):
+    """Per-row overhead and memory of the row wrappers for a 100k-row, 8-column result."""
+    columns = ('id', 'question', 'a', 'b', 'c', 'd', 'correct', 'explanation')
+    res = SimpleNamespace(columns=columns, rows=[(i, 'q', 'a', 'b', 'c', 'd', 'A', 'e') for i in range(count)])
+    cases = [
+        ("rows before (RowWrapper list)", lambda r: [LegacyRowWrapper(row, r.columns) for row in r.rows]),
+        ("rows after (Row list)", db.wrap_rows),
+        # Lazy mode wraps each row as it is consumed, so its cost shows up in the lookup pass
+        ("rows after (lazy iterate)", lazy_rows),
+    ]
+    for name, wrap in cases:
+        built, allocated, lookups = profile_rows(wrap, res)
+        RESULTS[name] = {
+            'wrap_ns_per_row': built / count * 1e9,
+            'lookup_ns_per_row': lookups / count * 1e9,
+            'bytes_per_row': allocated / count,
+        }
+        print(f"{name:<40} wrap {built / count * 1e9:>7.0f} ns/row | "
+              f"by-name lookup {lookups / count * 1e9:>7.0f} ns/row | memory {allocated / count:>6.1f} B/row")
+
+
+BENCHMARKS = {
+    'is_admin': bench_is_admin,
+    'rows': bench_rows,
+    'init_db': bench_init_db,
+    'update_user_stats': bench_update_user_stats,
+    'leaderboard': bench_leaderboard,
+    'ranks': bench_ranks,
+    'random_question': bench_random_question,
+}
+
+# ---------------- REGRESSION CHECK ----------------
+# Figures compared by --compare: lower is better unless the name ends in _per_s.
+# p99 is reported but not compared, it is too noisy on a shared machine.
+LOWER_IS_BETTER = ('mean_us', 'p50_us', '_ns_per_row', 'bytes_per_row')
+HIGHER_IS_BETTER = ('_per_s',)
+
+def compare(baseline, current, threshold):
+    """Prints figures that got worse than `threshold` (e.g. 0.2 = 20%). Returns how many did."""
+    regressions = 0
+    for name, figures in current.items():
+        for key, value in figures.items():
+            old = baseline.get(name, {}).get(key)
+            if not old or not isinstance(value, (int, float)):
+                continue
+            if key.endswith(HIGHER_IS_BETTER):
+                worse = value < old * (1 - threshold)
+            elif key.endswith(LOWER_IS_BETTER):
+                worse = value > old * (1 + threshold)
+            else:
+                continue
+            if worse:
+                regressions += 1
+                print(f"⚠️ Regression: {name} {key} {old:.1f} -> {value:.1f}")
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Offline NEETIQBot benchmarks")
+    parser.add_argument('benchmarks', nargs='*', help=f"any of: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--json', metavar='PATH', help="write results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="JSON from an earlier run to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown for --compare (default 0.2)")
+    args = parser.parse_args(argv)
+
+    selected = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown benchmark(s): {', '.join(unknown)}. Choose from: {', '.join(BENCHMARKS)}")
+
+    print(f"📊 Benchmark database ({db.DB_BACKEND}): {os.environ['SQLITE_PATH']}")
+    db.init_db()
+    try:
+        for name in selected:
+            BENCHMARKS[name]()
+    finally:
+        db.pool.close()
+        db._executor.shutdown()
+
+    run = {
+        'meta': {'timestamp': datetime.now().isoformat(), 'scale': BENCH_SCALE, 'backend': db.DB_BACKEND,
+                 'python': platform.python_version(), 'platform': platform.platform()},
+        'results': RESULTS,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(baseline, RESULTS, args.threshold):
+            sys.exit(1)
+        print("✅ No regressions")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
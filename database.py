@@ -1,7 +1,26 @@
 import os
-import libsql_client
+import sys
+import time
+import math
+import random
+import asyncio
+import functools
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from ranking import RankIndex, GroupRanks
+import metrics
+import storage
+
+# --- STORAGE BACKEND ---
+# 'turso' (default) talks to Turso over HTTP; 'sqlite' keeps everything in a local
+# WAL-mode file (SQLITE_PATH), so the bot runs with no network database at all.
+DB_BACKEND = os.environ.get("DB_BACKEND", "turso").lower()
+if DB_BACKEND not in ('turso', 'sqlite'):
+    raise ValueError(f"❌ DATABASE ERROR: unknown DB_BACKEND {DB_BACKEND!r} (use 'turso' or 'sqlite')")
 
 # --- TURSO CONFIGURATION ---
 # This pulls the values directly from Render Environment Variables
@@ -9,39 +28,108 @@ TURSO_URL = os.environ.get("TURSO_URL")
 TURSO_TOKEN = os.environ.get("TURSO_TOKEN")
 
 # This check will prevent the crash and tell you exactly what is missing
-if not TURSO_URL or not TURSO_TOKEN:
+if DB_BACKEND == 'turso' and (not TURSO_URL or not TURSO_TOKEN):
     raise ValueError("❌ DATABASE ERROR: TURSO_URL or TURSO_TOKEN is not set in Render Environment Variables!")
     
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
+# --- CONNECTION POOL CONFIGURATION ---
+# How many idle clients we keep open between queries
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+# Idle clients older than this get a 'SELECT 1' before being reused
+DB_POOL_HEALTHCHECK_SECONDS = float(os.environ.get("DB_POOL_HEALTHCHECK_SECONDS", "60"))
+
 from contextlib import contextmanager
 from datetime import datetime
 
 # --- TURSO COMPATIBILITY LAYER ---
-class RowWrapper:
-    """Allows accessing Turso rows by column name, mimicking sqlite3.Row."""
-    def __init__(self, row, columns):
-        self.row = row
-        self.columns = columns
+class Row:
+    """
+    Read-only row accessible by position or column name, mimicking sqlite3.Row.
+    Holds the driver's value sequence plus a column -> position map that is built
+    once per result set and shared by all of its rows.
+    """
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
     def __getitem__(self, key):
         if isinstance(key, str):
-            return self.row[self.columns.index(key)]
-        return self.row[key]
+            return self._values[self._index[key]]
+        return self._values[key]
     def __iter__(self):
-        return iter(self.row)
+        return iter(self._values)
+    def __len__(self):
+        return len(self._values)
+    def keys(self):
+        return list(self._index)
+    def __repr__(self):
+        return f"Row({tuple(self._values)!r})"
+
+def column_index(columns):
+    """Column name -> position (the first one wins for duplicate names, like list.index did)."""
+    index = {}
+    for i, name in enumerate(columns):
+        index.setdefault(name, i)
+    return index
+
+def wrap_rows(res):
+    index = column_index(res.columns)
+    return [Row(r, index) for r in res.rows]
+
+def _query_site(depth=2):
+    """Qualified name of the function `depth` frames up, used to label round-trip metrics."""
+    code = sys._getframe(depth).f_code
+    return getattr(code, 'co_qualname', code.co_name)
 
 class TursoCursor:
     """Wrapper to make Turso client behave like a standard cursor."""
-    def __init__(self, client):
+    def __init__(self, client, site=None):
         self.client = client
+        # Metrics label for this cursor's round trips; defaults to the calling function
+        self.site = site
+        self.target = getattr(client, 'target', 'primary')
+    def _roundtrip(self, site, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception:
+            metrics.db_errors.inc(site, self.target)
+            raise
+        finally:
+            metrics.db_seconds.observe(time.perf_counter() - start, site, self.target)
     def execute(self, sql, params=()):
-        res = self.client.execute(sql, params)
-        self.rows = [RowWrapper(r, res.columns) for r in res.rows]
+        res = self._roundtrip(self.site or _query_site(), self.client.execute, sql, params)
+        self.rows = wrap_rows(res)
+        self.rowcount = res.rows_affected
         return self
+    def iterate(self, sql, params=()):
+        """
+        Lazy mode for large reads: yields rows one at a time instead of building
+        a wrapped list, so a 100k-row result costs no per-row objects up front.
+        """
+        res = self._roundtrip(self.site or _query_site(), self.client.execute, sql, params)
+        self.rowcount = res.rows_affected
+        index = column_index(res.columns)
+        return (Row(r, index) for r in res.rows)
     def executemany(self, sql, params_list):
-        for params in params_list:
-            self.client.execute(sql, params)
+        self.batch([(sql, params) for params in params_list], site=self.site or _query_site())
         return self
+    def batch(self, statements, site=None):
+        """
+        Pipelines (sql, params) pairs in ONE round trip. libsql wraps a batch in a
+        single transaction, so either every statement applies or none do.
+        Returns one row list per statement; fetchone/fetchall read the last one.
+        """
+        statements = [(sql, tuple(params)) for sql, params in statements]
+        if not statements:
+            self.rows = []
+            return []
+        results = self._roundtrip(site or self.site or _query_site(), self.client.batch, statements)
+        self.results = [wrap_rows(res) for res in results]
+        self.rows = self.results[-1]
+        return self.results
     def fetchone(self):
         return self.rows[0] if hasattr(self, 'rows') and self.rows else None
     def fetchall(self):
@@ -49,179 +137,1325 @@ class TursoCursor:
     def commit(self):
         pass # Turso handles auto-commit per execute call
 
+# LibsqlError codes for a failed statement, as opposed to a broken connection
+SQL_ERROR_CODE_PREFIXES = ('SQLITE', 'SQL_')
+
+class ClientPool:
+    """
+    Keeps long-lived Turso clients alive so queries skip the connection/TLS setup.
+    Idle clients are health-checked before reuse and replaced when they fail.
+    If every pooled client is busy we open an extra one instead of blocking the event loop.
+    """
+    def __init__(self, size=DB_POOL_SIZE, healthcheck_seconds=DB_POOL_HEALTHCHECK_SECONDS):
+        import libsql_client
+        self._create_client = libsql_client.create_client_sync
+        self._error_type = libsql_client.LibsqlError
+        self.size = max(1, size)
+        self.healthcheck_seconds = healthcheck_seconds
+        self._idle = deque()  # (client, last_used) pairs, most recent on the right
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.counters = {
+            'created': 0, 'reused': 0, 'overflow': 0, 'discarded': 0,
+            'health_checks': 0, 'health_failures': 0,
+        }
+
+    def _connect(self):
+        self.counters['created'] += 1
+        return self._create_client(url=TURSO_URL, auth_token=TURSO_TOKEN)
+
+    def _is_healthy(self, client):
+        self.counters['health_checks'] += 1
+        try:
+            client.execute("SELECT 1")
+            return True
+        except Exception:
+            self.counters['health_failures'] += 1
+            return False
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    if self.in_use >= self.size:
+                        self.counters['overflow'] += 1
+                    self.in_use += 1
+                    break
+                client, last_used = self._idle.pop()
+                self.in_use += 1
+
+            stale = time.monotonic() - last_used > self.healthcheck_seconds
+            if client.closed or (stale and not self._is_healthy(client)):
+                self.discard(client)
+                continue
+            self.counters['reused'] += 1
+            return client
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self.in_use -= 1
+            raise
+
+    def release(self, client):
+        with self._lock:
+            self.in_use -= 1
+            if not client.closed and len(self._idle) < self.size:
+                self._idle.append((client, time.monotonic()))
+                return
+        client.close()
+
+    def discard(self, client):
+        """Drops a client that failed so the next acquire reconnects."""
+        with self._lock:
+            self.in_use -= 1
+            self.counters['discarded'] += 1
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for client, _ in idle:
+            client.close()
+
+    def is_sql_error(self, exc):
+        """
+        True if the statement failed but the client is still usable. LibsqlError also
+        covers dead transports (HRANA_WEBSOCKET_ERROR, CLIENT_CLOSED, SERVER_ERROR, ...)
+        that fail every later request, so only SQLite/SQL error codes keep the client.
+        """
+        code = getattr(exc, 'code', '') if isinstance(exc, self._error_type) else ''
+        return code.startswith(SQL_ERROR_CODE_PREFIXES)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'in_use': self.in_use, 'idle': len(self._idle), 'size': self.size, 'backend': 'turso'}
+
+# Both backends follow the same pool contract (see storage.py)
+pool = storage.SQLiteBackend() if DB_BACKEND == 'sqlite' else ClientPool()
+
+def pool_stats():
+    """Pool counters (created/reused/discarded clients, in use, idle)."""
+    return pool.stats()
+
+# --- LOCAL READ REPLICA ---
+# Optional libsql embedded replica (needs the `libsql-experimental` package): a local
+# file kept in sync with Turso, serving reads that can be a few seconds stale.
+REPLICA_PATH = os.environ.get("REPLICA_PATH", "")
+REPLICA_SYNC_SECONDS = float(os.environ.get("REPLICA_SYNC_SECONDS", "5"))
+# Past this lag (failed syncs) stale reads go back to the primary
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "60"))
+
+class LocalReplica:
+    """
+    Client-like wrapper (execute/batch returning result sets) around an embedded
+    replica connection, so TursoCursor works on top of it unchanged. Reads only:
+    writes always go to the primary through the pool.
+    """
+    target = 'replica'
+
+    def __init__(self, path=REPLICA_PATH, max_lag=REPLICA_MAX_LAG_SECONDS):
+        self.path = path
+        self.max_lag = max_lag
+        self._conn = None
+        self._lock = threading.Lock()  # the embedded connection is not thread-safe
+        self.synced_at = None
+        self.counters = {'syncs': 0, 'sync_failures': 0, 'reads': 0}
+
+    @property
+    def enabled(self):
+        # A local SQLite backend is already as close as a replica would be
+        return bool(self.path) and DB_BACKEND == 'turso'
+
+    def open(self):
+        import libsql_experimental
+        self._conn = libsql_experimental.connect(self.path, sync_url=TURSO_URL, auth_token=TURSO_TOKEN)
+        self.sync()
+
+    def sync(self):
+        """Pulls new frames from the primary."""
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.sync()
+        except Exception:
+            self.counters['sync_failures'] += 1
+            raise
+        self.synced_at = time.time()
+        self.counters['syncs'] += 1
+
+    @property
+    def lag_seconds(self):
+        """Seconds since the last successful sync (None before the first one)."""
+        return None if self.synced_at is None else time.time() - self.synced_at
+
+    @property
+    def ready(self):
+        lag = self.lag_seconds
+        return lag is not None and lag <= self.max_lag
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, tuple(params))
+            rows = cursor.fetchall()
+            columns = tuple(d[0] for d in cursor.description or ())
+        self.counters['reads'] += 1
+        return SimpleNamespace(columns=columns, rows=rows, rows_affected=0)
+
+    def batch(self, statements):
+        return [self.execute(sql, params) for sql, params in statements]
+
+    def stats(self):
+        return {**self.counters, 'lag_seconds': self.lag_seconds, 'ready': self.ready}
+
+replica = LocalReplica()
+
 @contextmanager
-def get_db():
-    """Synchronous context manager for Turso Cloud connection."""
-    client = libsql_client.create_client_sync(url=TURSO_URL, auth_token=TURSO_TOKEN)
+def get_db(fresh=True):
+    """
+    Synchronous context manager that borrows a client from the storage backend.
+    fresh=False declares a read that may be a few seconds stale; it is served by
+    the local replica when one is configured and in sync.
+    """
+    if not fresh and replica.ready:
+        yield TursoCursor(replica)
+        return
+    client = pool.acquire()
     try:
         yield TursoCursor(client)
-    finally:
-        client.close()
+    except BaseException as e:
+        if pool.is_sql_error(e):
+            # SQL-level error: the connection itself is still fine
+            pool.release(client)
+        else:
+            # Network/transport failure: throw the client away and reconnect next time
+            pool.discard(client)
+        raise
+    else:
+        pool.release(client)
+
+# --- ASYNC ACCESS LAYER ---
+# Handlers must never run a Turso round trip on the event loop, so every call from
+# main.py goes through this bounded worker pool (one thread per pooled client).
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+async def run(func, *args, **kwargs):
+    """Runs a synchronous database function on the worker pool and awaits its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+# The async helpers below label their round trips with the handler that awaited them
+# Reads pass fresh=False when a few seconds of staleness is fine (see get_db)
+def _execute(sql, params=(), site=None):
+    with get_db() as conn:
+        conn.site = site
+        conn.execute(sql, params)
+
+def _fetchone(sql, params=(), site=None, fresh=True):
+    with get_db(fresh) as conn:
+        conn.site = site
+        return conn.execute(sql, params).fetchone()
+
+def _fetchall(sql, params=(), site=None, fresh=True):
+    with get_db(fresh) as conn:
+        conn.site = site
+        return conn.execute(sql, params).fetchall()
+
+async def execute(sql, params=()):
+    """Async single-statement write."""
+    await run(_execute, sql, params, _query_site())
+
+async def fetchone(sql, params=(), fresh=True):
+    """Async single-row read (None if no rows)."""
+    return await run(_fetchone, sql, params, _query_site(), fresh)
+
+async def fetchall(sql, params=(), fresh=True):
+    """Async multi-row read."""
+    return await run(_fetchall, sql, params, _query_site(), fresh)
+
+def _batch(statements, site=None, fresh=True):
+    with get_db(fresh) as conn:
+        conn.site = site
+        return conn.batch(statements)
+
+async def batch(statements, fresh=True):
+    """
+    Async pipelined batch of (sql, params) pairs; returns one row list per statement.
+    Only all-read batches may pass fresh=False.
+    """
+    return await run(_batch, statements, _query_site(), fresh)
+
+SETTINGS_DEFAULTS = {
+    'footer_text': 'NEETIQBot',
+    'footer_enabled': '1',
+    'autoquiz_enabled': '0',
+    'autoquiz_interval': '30',
+    'compliments_enabled': '1',
+}
+
+# Columns added after the first release: (table, column, type, backfill statement or None)
+ADDED_COLUMNS = [
+    ('stats', 'last_activity_date', 'TEXT', None),
+    # Polls that already exist start their TTL at upgrade time instead of being purged at once
+    ('active_polls', 'created_at', 'INTEGER',
+     "UPDATE active_polls SET created_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE created_at IS NULL"),
+    # Set when the bot can no longer post in a group; auto quiz skips it until /start clears it
+    ('chats', 'quiz_failed_at', 'TEXT', None),
+]
+
+# Tables created by migration 1 (fresh databases get the ADDED_COLUMNS inline)
+BASE_SCHEMA = [
+    # 1. Questions, Users, and Chats (Standard Setup)
+    """CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        question TEXT, a TEXT, b TEXT, c TEXT, d TEXT, 
+        correct TEXT, explanation TEXT)""",
+
+    """CREATE TABLE IF NOT EXISTS active_polls (
+        poll_id TEXT PRIMARY KEY, chat_id INTEGER, correct_option_id INTEGER, created_at INTEGER)""",
+
+    """CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, joined_at TEXT)""",
+
+    """CREATE TABLE IF NOT EXISTS chats (
+        chat_id INTEGER PRIMARY KEY, type TEXT, title TEXT, added_at TEXT, quiz_failed_at TEXT)""",
+
+    "CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY, added_at TEXT)",
+
+    # 2. Stats Table (Base Structure)
+    """CREATE TABLE IF NOT EXISTS stats (
+        user_id INTEGER PRIMARY KEY, 
+        attempted INTEGER DEFAULT 0,
+        correct INTEGER DEFAULT 0, 
+        score INTEGER DEFAULT 0, 
+        current_streak INTEGER DEFAULT 0, 
+        max_streak INTEGER DEFAULT 0,
+        last_activity_date TEXT)""",
+
+    # 3. Daily Stats Table (New Table)
+    """CREATE TABLE IF NOT EXISTS daily_stats (
+        user_id INTEGER, 
+        day TEXT, 
+        attempted INTEGER DEFAULT 0, 
+        correct INTEGER DEFAULT 0,
+        PRIMARY KEY(user_id, day))""",
+
+    # Rollups of compacted daily_stats rows (week = its Monday, month = 'YYYY-MM')
+    """CREATE TABLE IF NOT EXISTS weekly_stats (
+        user_id INTEGER, week TEXT, attempted INTEGER DEFAULT 0, correct INTEGER DEFAULT 0,
+        PRIMARY KEY(user_id, week))""",
+    """CREATE TABLE IF NOT EXISTS monthly_stats (
+        user_id INTEGER, month TEXT, attempted INTEGER DEFAULT 0, correct INTEGER DEFAULT 0,
+        PRIMARY KEY(user_id, month))""",
+
+    # 4. Group Stats and Customization
+    """CREATE TABLE IF NOT EXISTS group_stats (
+        chat_id INTEGER, user_id INTEGER, score INTEGER DEFAULT 0, 
+        attempted INTEGER DEFAULT 0, correct INTEGER DEFAULT 0,
+        PRIMARY KEY(chat_id, user_id))""",
+
+    "CREATE TABLE IF NOT EXISTS compliments (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, text TEXT)",
+    "CREATE TABLE IF NOT EXISTS group_compliments (chat_id INTEGER, type TEXT, text TEXT)",
+    "CREATE TABLE IF NOT EXISTS group_settings (chat_id INTEGER PRIMARY KEY, compliments_enabled INTEGER DEFAULT 1)",
+    "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)",
+
+    # 5. Broadcast jobs and their per-target delivery state
+    """CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, target TEXT, status TEXT,
+        created_by INTEGER, status_chat_id INTEGER, status_message_id INTEGER,
+        total INTEGER DEFAULT 0, users_ok INTEGER DEFAULT 0, groups_ok INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0, created_at TEXT, finished_at TEXT)""",
+    """CREATE TABLE IF NOT EXISTS broadcast_targets (
+        job_id INTEGER, chat_id INTEGER, kind TEXT, state INTEGER DEFAULT 0,
+        PRIMARY KEY(job_id, chat_id))""",
+]
+
+# --- SCHEMA MIGRATIONS ---
+# (version, description, statements), applied in order and exactly once. The current
+# version lives in the single schema_version row; never edit a shipped migration,
+# append a new one instead.
+MIGRATIONS = [
+    (1, "baseline schema and default settings",
+     [(sql, ()) for sql in BASE_SCHEMA]
+     + [("INSERT OR IGNORE INTO settings VALUES (?,?)", d) for d in SETTINGS_DEFAULTS.items()]),
+    # Leaderboard/rank sorts, compliment lookups and the group fan-out filters
+    (2, "hot-path indexes", [
+        ("CREATE INDEX IF NOT EXISTS idx_stats_score ON stats(score)", ()),
+        ("CREATE INDEX IF NOT EXISTS idx_group_stats_chat_score ON group_stats(chat_id, score)", ()),
+        ("CREATE INDEX IF NOT EXISTS idx_compliments_type ON compliments(type)", ()),
+        ("CREATE INDEX IF NOT EXISTS idx_group_compliments_chat_type ON group_compliments(chat_id, type)", ()),
+        ("CREATE INDEX IF NOT EXISTS idx_chats_type ON chats(type)", ()),
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _missing_column_statements(conn, baseline):
+    """
+    Databases created before versioned migrations may predate ADDED_COLUMNS
+    (fresh ones already have them from BASE_SCHEMA). Creates the baseline tables,
+    inspects them and returns (ALTER/backfill statements, added column names), so
+    the caller can apply them in the same transaction as the version bump.
+    """
+    tables = list(dict.fromkeys(table for table, *_ in ADDED_COLUMNS))
+    results = conn.batch(baseline + [(f"PRAGMA table_info({table})", ()) for table in tables])
+    existing = {table: [col['name'] for col in rows] for table, rows in zip(tables, results[-len(tables):])}
+    statements, added = [], []
+    for table, column, col_type, backfill in ADDED_COLUMNS:
+        if column not in existing[table]:
+            statements.append((f"ALTER TABLE {table} ADD COLUMN {column} {col_type}", ()))
+            if backfill:
+                statements.append((backfill, ()))
+            added.append(f"'{column}' to {table}")
+    return statements, added
 
 def init_db():
-    """Initializes tables and automatically adds missing columns/tables for updates."""
+    """
+    Brings the schema up to SCHEMA_VERSION. An up-to-date database costs one round
+    trip (the version check); pending migrations are applied together in one batch.
+    Any failure raises with the version unchanged, so the next boot retries.
+    """
     with get_db() as conn:
-        # 1. Questions, Users, and Chats (Standard Setup)
-        conn.execute("""CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question TEXT, a TEXT, b TEXT, c TEXT, d TEXT, 
-            correct TEXT, explanation TEXT)""")
-
-        conn.execute("""CREATE TABLE IF NOT EXISTS active_polls (
-            poll_id TEXT PRIMARY KEY, chat_id INTEGER, correct_option_id INTEGER)""")
-
-        conn.execute("""CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, joined_at TEXT)""")
-
-        conn.execute("""CREATE TABLE IF NOT EXISTS chats (
-            chat_id INTEGER PRIMARY KEY, type TEXT, title TEXT, added_at TEXT)""")
-
-        conn.execute("CREATE TABLE IF NOT EXISTS admins (user_id INTEGER PRIMARY KEY, added_at TEXT)")
-
-        # 2. Stats Table (Base Structure)
-        conn.execute("""CREATE TABLE IF NOT EXISTS stats (
-            user_id INTEGER PRIMARY KEY, 
-            attempted INTEGER DEFAULT 0,
-            correct INTEGER DEFAULT 0, 
-            score INTEGER DEFAULT 0, 
-            current_streak INTEGER DEFAULT 0, 
-            max_streak INTEGER DEFAULT 0)""")
-
-        # --- AUTO-UPDATE SECTION (Migrations) ---
-        # This part checks if your existing 'stats' table is missing the new date column
-        try:
-            # Get list of existing columns in 'stats'
-            cursor = conn.execute("PRAGMA table_info(stats)")
-            columns = [col['name'] for col in cursor.fetchall()]
-            
-            if 'last_activity_date' not in columns:
-                conn.execute("ALTER TABLE stats ADD COLUMN last_activity_date TEXT")
-                print("🔹 Migration: Added 'last_activity_date' to stats table.")
-        except Exception as e:
-            print(f"⚠️ Migration Error (Stats): {e}")
-
-        # 3. Daily Stats Table (New Table)
-        conn.execute("""CREATE TABLE IF NOT EXISTS daily_stats (
-            user_id INTEGER, 
-            day TEXT, 
-            attempted INTEGER DEFAULT 0, 
-            correct INTEGER DEFAULT 0,
-            PRIMARY KEY(user_id, day))""")
-
-        # 4. Group Stats and Customization
-        conn.execute("""CREATE TABLE IF NOT EXISTS group_stats (
-            chat_id INTEGER, user_id INTEGER, score INTEGER DEFAULT 0, 
-            attempted INTEGER DEFAULT 0, correct INTEGER DEFAULT 0,
-            PRIMARY KEY(chat_id, user_id))""")
-
-        conn.execute("CREATE TABLE IF NOT EXISTS compliments (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, text TEXT)")
-        conn.execute("CREATE TABLE IF NOT EXISTS group_compliments (chat_id INTEGER, type TEXT, text TEXT)")
-        conn.execute("CREATE TABLE IF NOT EXISTS group_settings (chat_id INTEGER PRIMARY KEY, compliments_enabled INTEGER DEFAULT 1)")
-        conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
-        
-        defaults = [
-            ('footer_text', 'NEETIQBot'),
-            ('footer_enabled', '1'),
-            ('autoquiz_enabled', '0'),
-            ('autoquiz_interval', '30'),
-            ('compliments_enabled', '1')
-        ]
-        conn.executemany("INSERT OR IGNORE INTO settings VALUES (?,?)", defaults)
-        
-    print("✅ Turso Database Initialized and Auto-Updated!")
+        _, version_rows = conn.batch([
+            ("CREATE TABLE IF NOT EXISTS schema_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)", ()),
+            ("SELECT version FROM schema_version WHERE id = 1", ()),
+        ])
+        current = version_rows[0][0] if version_rows else 0
+        pending = [m for m in MIGRATIONS if m[0] > current]
+        if not pending:
+            return
+
+        statements, added = [], []
+        for version, _, migration in pending:
+            statements += migration
+            if version == 1:
+                # Legacy column upgrade goes right after the baseline, before later migrations
+                column_statements, added = _missing_column_statements(conn, migration)
+                statements += column_statements
+        statements.append((
+            "INSERT INTO schema_version (id, version) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET version = excluded.version",
+            (SCHEMA_VERSION,)
+        ))
+        # One transaction: either every pending migration and the version bump apply, or none do
+        conn.batch(statements)
+        for version, description, _ in pending:
+            print(f"🔹 Migration {version}: {description}")
+        for column in added:
+            print(f"🔹 Migration: Added {column} table.")
+
+    print(f"✅ Database schema upgraded to version {SCHEMA_VERSION}")
 
 
         
+# --- WRITE-BEHIND STATS BUFFER ---
+# Poll answers are folded in memory and written in bulk instead of 4 upserts per answer
+STATS_FLUSH_SIZE = int(os.environ.get("STATS_FLUSH_SIZE", "500"))          # answers
+STATS_FLUSH_SECONDS = float(os.environ.get("STATS_FLUSH_SECONDS", "5"))   # max delay
+# Rows per bulk statement (keeps us far below SQLite's bound-parameter limit)
+STATS_FLUSH_CHUNK = 100
+
+class StreakDelta:
+    """
+    Folded answers of one user, in arrival order.
+    lead = corrects before the first wrong answer, best = longest correct run inside
+    the sequence, trail = corrects after the last wrong answer (all three equal the
+    number of answers when nothing was wrong).
+    """
+    __slots__ = ('attempted', 'correct', 'score', 'lead', 'best', 'trail', 'day', 'username', 'first_name')
+
+    def __init__(self):
+        self.attempted = self.correct = self.score = 0
+        self.lead = self.best = self.trail = 0
+        self.day = self.username = self.first_name = None
+
+    @property
+    def broken(self):
+        return self.correct < self.attempted
+
+    def add(self, is_correct, day):
+        self.attempted += 1
+        self.day = day
+        if is_correct:
+            self.correct += 1
+            self.score += 4
+            self.trail += 1
+            if not self.broken:
+                self.lead += 1
+            self.best = max(self.best, self.trail)
+        else:
+            self.score -= 1
+            self.trail = 0
+
+    def prepend(self, older):
+        """Folds an older delta in front of this one (used to retry a failed flush)."""
+        lead = older.lead + self.lead if not older.broken else older.lead
+        trail = self.trail if self.broken else older.trail + self.trail
+        self.best = max(older.best, self.best, older.trail + self.lead)
+        self.lead, self.trail = lead, trail
+        self.attempted += older.attempted
+        self.correct += older.correct
+        self.score += older.score
+        self.day = self.day or older.day
+        # username/first_name stay as they are: this delta holds the newer profile
+
+class StatsBuffer:
+    """Collects per (user, chat, day) increments and applies them in periodic bulk flushes."""
+    def __init__(self, flush_size=STATS_FLUSH_SIZE):
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reset()
+        self.counters = {'answers': 0, 'flushes': 0, 'flushed_answers': 0, 'failed_flushes': 0}
+
+    def _reset(self):
+        self._users = {}    # user_id -> StreakDelta
+        self._daily = {}    # (user_id, day) -> [attempted, correct]
+        self._groups = {}   # (chat_id, user_id) -> [attempted, correct, score]
+        self.pending = 0
+        self._flush_requested = False  # set once pending crosses flush_size, until the next flush
+
+    def record(self, user_id, chat_id, is_correct, username=None, first_name=None, day=None):
+        """
+        Buffers one answer. Returns True only for the answer that makes the buffer big
+        enough to flush, so callers schedule one flush rather than one per answer.
+        """
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        correct_inc = 1 if is_correct else 0
+        with self._lock:
+            delta = self._users.get(user_id)
+            if delta is None:
+                delta = self._users[user_id] = StreakDelta()
+            delta.add(is_correct, day)
+            # Latest answer wins, including a removed (None) username
+            delta.username = username
+            delta.first_name = first_name
+
+            daily = self._daily.setdefault((user_id, day), [0, 0])
+            daily[0] += 1
+            daily[1] += correct_inc
+
+            if chat_id:
+                group = self._groups.setdefault((chat_id, user_id), [0, 0, 0])
+                group[0] += 1
+                group[1] += correct_inc
+                group[2] += 4 if is_correct else -1
+
+            self.pending += 1
+            self.counters['answers'] += 1
+            if self.pending >= self.flush_size and not self._flush_requested:
+                self._flush_requested = True
+                return True
+            return False
+
+    def _restore(self, users, daily, groups):
+        """Puts a snapshot that failed to flush back in front of anything recorded since."""
+        with self._lock:
+            for user_id, older in users.items():
+                newer = self._users.get(user_id)
+                if newer is None:
+                    self._users[user_id] = older
+                else:
+                    newer.prepend(older)
+            for key, (att, corr) in daily.items():
+                row = self._daily.setdefault(key, [0, 0])
+                row[0] += att
+                row[1] += corr
+            for key, (att, corr, score) in groups.items():
+                row = self._groups.setdefault(key, [0, 0, 0])
+                row[0] += att
+                row[1] += corr
+                row[2] += score
+            self.pending += sum(d.attempted for d in users.values())
+
+    def flush(self):
+        """Writes everything buffered so far in one atomic batch. Returns the answers flushed."""
+        with self._flush_lock:
+            with self._lock:
+                users, daily, groups = self._users, self._daily, self._groups
+                self._reset()
+            if not users:
+                return 0
+
+            try:
+                with get_db() as conn:
+                    conn.batch(_stats_flush_statements(users, daily, groups))
+            except Exception:
+                self.counters['failed_flushes'] += 1
+                self._restore(users, daily, groups)
+                raise
+
+            answers = sum(d.attempted for d in users.values())
+            self.counters['flushes'] += 1
+            self.counters['flushed_answers'] += answers
+            return answers
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'pending': self.pending, 'pending_users': len(self._users)}
+
+def _chunks(items, size=STATS_FLUSH_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _stats_flush_statements(users, daily, groups):
+    """Builds the bulk upserts for one flush (a few statements per 100 rows)."""
+    statements = []
+
+    # 1. Sync User Profile Info
+    for chunk in _chunks(users.items()):
+        statements.append((
+            "INSERT INTO users (user_id, username, first_name) VALUES "
+            + ", ".join(["(?, ?, ?)"] * len(chunk))
+            + """ ON CONFLICT(user_id) DO UPDATE SET 
+                username = excluded.username, 
+                first_name = excluded.first_name""",
+            [v for uid, d in chunk for v in (uid, d.username, d.first_name)]
+        ))
+
+    # 2. Global Stats: make sure every row exists, then fold the deltas in.
+    # Streak rule (same as answering one by one): if the batch had a wrong answer the
+    # streak becomes the trailing run, otherwise it keeps growing; max_streak also
+    # considers the old streak extended by the leading run.
+    for chunk in _chunks(users.items()):
+        statements.append((
+            "INSERT OR IGNORE INTO stats (user_id) VALUES " + ", ".join(["(?)"] * len(chunk)),
+            [uid for uid, _ in chunk]
+        ))
+        statements.append((
+            "WITH v(user_id, attempted, correct, score, lead, best, trail, broken, day) AS (VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+            + """)
+            UPDATE stats SET 
+                attempted = stats.attempted + v.attempted,
+                correct = stats.correct + v.correct,
+                score = stats.score + v.score,
+                current_streak = CASE WHEN v.broken THEN v.trail ELSE stats.current_streak + v.trail END,
+                max_streak = MAX(stats.max_streak, stats.current_streak + v.lead, v.best),
+                last_activity_date = v.day
+            FROM v WHERE stats.user_id = v.user_id""",
+            [val for uid, d in chunk for val in
+             (uid, d.attempted, d.correct, d.score, d.lead, d.best, d.trail, int(d.broken), d.day)]
+        ))
+
+    # 3. Update Daily Stats Tracker (For 'Today's Accuracy')
+    for chunk in _chunks(daily.items()):
+        statements.append((
+            "INSERT INTO daily_stats (user_id, day, attempted, correct) VALUES "
+            + ", ".join(["(?, ?, ?, ?)"] * len(chunk))
+            + """ ON CONFLICT(user_id, day) DO UPDATE SET 
+                attempted = attempted + excluded.attempted,
+                correct = correct + excluded.correct""",
+            [v for (uid, day), (att, corr) in chunk for v in (uid, day, att, corr)]
+        ))
+
+    # 4. Update Group-Specific Stats
+    for chunk in _chunks(groups.items()):
+        statements.append((
+            "INSERT INTO group_stats (user_id, chat_id, attempted, correct, score) VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+            + """ ON CONFLICT(user_id, chat_id) DO UPDATE SET 
+                attempted = attempted + excluded.attempted,
+                correct = correct + excluded.correct,
+                score = score + excluded.score""",
+            [v for (chat_id, uid), (att, corr, score) in chunk for v in (uid, chat_id, att, corr, score)]
+        ))
+
+    return statements
+
+stats_buffer = StatsBuffer()
+
+# --- RANK INDEXES ---
+# In-memory mirrors of stats.score and group_stats.score for O(log n) rank lookups.
+# Rebuilt from the tables at startup and kept in sync by update_user_stats.
+global_ranks = RankIndex()
+group_ranks = GroupRanks()
+
+def load_ranks():
+    with get_db() as conn:
+        global_rows, group_rows = conn.batch([
+            ("SELECT user_id, score FROM stats", ()),
+            ("SELECT chat_id, user_id, score FROM group_stats", ()),
+        ])
+    global_ranks.load((r[0], r[1]) for r in global_rows)
+    group_ranks.load((r[0], r[1], r[2]) for r in group_rows)
+
 def update_user_stats(user_id, chat_id, is_correct, username=None, first_name=None):
     """
-    Updates global, daily, and group stats with strict streak-reset logic.
-    Refined for Turso Compatibility.
+    Records one answer in the write-behind buffer (global, daily, and group stats,
+    with strict streak-reset logic) and in the rank indexes. Nothing touches the
+    network here; call flush_stats() when this returns True, on a timer and on shutdown.
     """
-    today = datetime.now().strftime('%Y-%m-%d')
     score_change = 4 if is_correct else -1
-    correct_inc = 1 if is_correct else 0
+    global_ranks.add(user_id, score_change)
+    if chat_id:
+        group_ranks.add(chat_id, user_id, score_change)
+    return stats_buffer.record(user_id, chat_id, is_correct, username=username, first_name=first_name)
 
+def flush_stats():
+    """Applies buffered stats to the database. Returns the number of answers written."""
+    return stats_buffer.flush()
+
+# --- DAILY STATS COMPACTION ---
+# Raw daily_stats rows older than this many days are folded into weekly/monthly rollups
+DAILY_STATS_RETENTION_DAYS = int(os.environ.get("DAILY_STATS_RETENTION_DAYS", "35"))
+
+# (table, key column, SQL expression deriving the key from daily_stats.day)
+STATS_ROLLUPS = (
+    ('weekly_stats', 'week', "date(day, 'weekday 0', '-6 days')"),
+    ('monthly_stats', 'month', "substr(day, 1, 7)"),
+)
+
+def compact_daily_stats(retention_days=DAILY_STATS_RETENTION_DAYS, today=None):
+    """
+    Rolls daily_stats rows older than the retention window into weekly_stats and
+    monthly_stats, then deletes them. Everything runs as one batch, so a row is
+    either rolled up and removed or left untouched. Returns the rows compacted.
+    """
+    today = today or datetime.now().date()
+    # Today's row is still being written by the stats buffer, so always keep it
+    cutoff = (today - timedelta(days=max(1, retention_days))).isoformat()
+    statements = [(
+        f"""INSERT INTO {table} (user_id, {column}, attempted, correct)
+            SELECT user_id, {expr}, SUM(attempted), SUM(correct) FROM daily_stats
+            WHERE day < ? GROUP BY user_id, {expr}
+            ON CONFLICT(user_id, {column}) DO UPDATE SET
+                attempted = attempted + excluded.attempted,
+                correct = correct + excluded.correct""",
+        (cutoff,)
+    ) for table, column, expr in STATS_ROLLUPS]
+    statements += [
+        ("SELECT COUNT(*) FROM daily_stats WHERE day < ?", (cutoff,)),
+        ("DELETE FROM daily_stats WHERE day < ?", (cutoff,)),
+    ]
     with get_db() as conn:
-        # 1. Sync User Profile Info
-        conn.execute("""
-            INSERT INTO users (user_id, username, first_name) 
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET 
-                username = COALESCE(excluded.username, username), 
-                first_name = COALESCE(excluded.first_name, first_name)
-        """, (user_id, username, first_name))
-
-        # 2. Update Global Stats & Streak Reset Logic
-        if is_correct:
-            # Increment current_streak and conditionally update max_streak
-            conn.execute("""
-                INSERT INTO stats (user_id, attempted, correct, score, current_streak, max_streak, last_activity_date) 
-                VALUES (?, 1, 1, 4, 1, 1, ?)
-                ON CONFLICT(user_id) DO UPDATE SET 
-                    attempted = attempted + 1,
-                    correct = correct + 1,
-                    score = score + 4,
-                    current_streak = current_streak + 1,
-                    max_streak = CASE WHEN (current_streak + 1) > max_streak THEN (current_streak + 1) ELSE max_streak END,
-                    last_activity_date = ?
-            """, (user_id, today, today))
-        else:
-            # RESET current_streak to 0 on wrong answer
-            conn.execute("""
-                INSERT INTO stats (user_id, attempted, correct, score, current_streak, last_activity_date) 
-                VALUES (?, 1, 0, -1, 0, ?)
-                ON CONFLICT(user_id) DO UPDATE SET 
-                    attempted = attempted + 1,
-                    score = score - 1,
-                    current_streak = 0,
-                    last_activity_date = ?
-            """, (user_id, today, today))
-
-        # 3. Update Daily Stats Tracker (For 'Today's Accuracy')
-        conn.execute("""
-            INSERT INTO daily_stats (user_id, day, attempted, correct) 
-            VALUES (?, ?, 1, ?)
-            ON CONFLICT(user_id, day) DO UPDATE SET 
-                attempted = attempted + 1,
-                correct = correct + ?
-        """, (user_id, today, correct_inc, correct_inc))
-
-        # 4. Update Group-Specific Stats
-        if chat_id:
-            conn.execute("""
-                INSERT INTO group_stats (user_id, chat_id, attempted, correct, score) 
-                VALUES (?, ?, 1, ?, ?)
-                ON CONFLICT(user_id, chat_id) DO UPDATE SET 
-                    attempted = attempted + 1,
-                    correct = correct + ?,
-                    score = score + ?
-            """, (user_id, chat_id, correct_inc, score_change, correct_inc, score_change))
-            
-
-def get_leaderboard_data(chat_id=None, limit=25):
+        results = conn.batch(statements)
+    return results[-2][0][0]
+
+
+# --- SETTINGS CACHE ---
+# Safety net for edits made outside the bot (e.g. straight in the Turso console)
+SETTINGS_TTL_SECONDS = float(os.environ.get("SETTINGS_TTL_SECONDS", "300"))
+
+class SettingsCache:
+    """
+    In-memory copy of `settings` and `group_settings`, loaded at startup.
+    Readers never touch the network; writers go through set()/set_group_compliments()
+    which update the table and the cache together.
+    """
+    def __init__(self, ttl=SETTINGS_TTL_SECONDS):
+        self.ttl = ttl
+        self._values = dict(SETTINGS_DEFAULTS)
+        self._group_compliments = {}  # chat_id -> bool, missing means enabled
+        self.loaded_at = None
+
+    def load(self):
+        with get_db() as conn:
+            settings_rows, group_rows = conn.batch([
+                ("SELECT key, value FROM settings", ()),
+                ("SELECT chat_id, compliments_enabled FROM group_settings", ()),
+            ])
+        self._values = {**SETTINGS_DEFAULTS, **{r[0]: r[1] for r in settings_rows}}
+        self._group_compliments = {r[0]: r[1] != 0 for r in group_rows}
+        self.loaded_at = time.monotonic()
+
+    def get(self, key):
+        return self._values.get(key)
+
+    def set(self, key, value):
+        value = str(value)
+        with get_db() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+        self._values[key] = value
+
+    # Typed accessors
+    @property
+    def footer_text(self) -> str:
+        return self._values['footer_text']
+
+    @property
+    def footer_enabled(self) -> bool:
+        return self._values['footer_enabled'] == '1'
+
+    @property
+    def autoquiz_enabled(self) -> bool:
+        return self._values['autoquiz_enabled'] == '1'
+
+    @property
+    def autoquiz_interval(self) -> int:
+        try:
+            return int(self._values['autoquiz_interval'])
+        except (TypeError, ValueError):
+            return int(SETTINGS_DEFAULTS['autoquiz_interval'])
+
+    @property
+    def compliments_enabled(self) -> bool:
+        return self._values['compliments_enabled'] == '1'
+
+    def group_compliments_enabled(self, chat_id) -> bool:
+        return self._group_compliments.get(chat_id, True)
+
+    def set_group_compliments(self, chat_id, enabled: bool):
+        with get_db() as conn:
+            conn.execute("INSERT OR REPLACE INTO group_settings (chat_id, compliments_enabled) VALUES (?, ?)",
+                         (chat_id, 1 if enabled else 0))
+        self._group_compliments[chat_id] = bool(enabled)
+
+settings = SettingsCache()
+
+# --- ADMIN CACHE ---
+ADMINS_REFRESH_SECONDS = float(os.environ.get("ADMINS_REFRESH_SECONDS", "600"))
+
+class AdminCache:
+    """Set of admin user_ids so authorization checks are O(1) and never touch the network."""
+    def __init__(self):
+        # Replaced (never mutated) so readers always see a consistent set
+        self._ids = frozenset()
+        self.loaded_at = None
+
+    def load(self):
+        with get_db() as conn:
+            rows = conn.execute("SELECT user_id FROM admins").fetchall()
+        self._ids = frozenset(r[0] for r in rows)
+        self.loaded_at = time.monotonic()
+
+    def __contains__(self, user_id):
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def ids(self):
+        return sorted(self._ids)
+
+    def add(self, user_id):
+        with get_db() as conn:
+            conn.execute("INSERT OR IGNORE INTO admins (user_id, added_at) VALUES (?,?)",
+                         (user_id, str(datetime.now())))
+        self._ids = self._ids | {user_id}
+
+    def remove(self, user_id):
+        with get_db() as conn:
+            conn.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
+        self._ids = self._ids - {user_id}
+
+admins = AdminCache()
+
+# --- QUESTION POOL ---
+# How many questions are buffered per refill
+QUESTION_PREFETCH = int(os.environ.get("QUESTION_PREFETCH", "32"))
+# Most random ids probed per refill (claimed questions leave holes in the id range)
+QUESTION_SAMPLE_LIMIT = 4000
+QUESTION_SAMPLE_CHUNK = 500
+
+class QuestionPool:
+    """
+    Random question picker without ORDER BY RANDOM() full scans.
+    Candidates come from rejection sampling: random ids between MIN(id) and MAX(id)
+    are looked up exactly and only the ones that exist are kept, so every remaining
+    question is equally likely however many holes claimed questions have left.
+    (Seeking to the next id after a random point would favour questions that sit
+    behind big gaps.) They are kept in a shuffled buffer and claimed with
+    DELETE ... RETURNING, so two concurrent callers can never receive the same question.
+    """
+    COLUMNS = "id, question, a, b, c, d, correct, explanation"
+
+    def __init__(self, prefetch=QUESTION_PREFETCH):
+        self.prefetch = max(1, prefetch)
+        self._ids = []
+        self._lock = threading.Lock()
+        self.counters = {'refills': 0, 'claimed': 0, 'missed': 0, 'restored': 0}
+
+    def _refill(self, conn):
+        lo, hi, count = conn.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM questions").fetchone()
+        if not count:
+            return
+        span = hi - lo + 1
+        # Enough distinct ids to expect ~prefetch hits at the current density
+        draws = min(span, QUESTION_SAMPLE_LIMIT, math.ceil(self.prefetch * span / count * 1.5))
+        sample = random.sample(range(lo, hi + 1), draws)
+        lookups = [(f"SELECT id FROM questions WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                   for chunk in _chunks(sample, QUESTION_SAMPLE_CHUNK)]
+        ids = [row[0] for rows in conn.batch(lookups) for row in rows]
+        if not ids:
+            # Too sparse for id sampling: uniform random positions instead
+            offsets = random.sample(range(count), min(count, self.prefetch))
+            ids = [rows[0][0] for rows in conn.batch([
+                ("SELECT id FROM questions ORDER BY id LIMIT 1 OFFSET ?", (offset,)) for offset in offsets
+            ]) if rows]
+        random.shuffle(ids)
+        self._ids = ids
+        self.counters['refills'] += 1
+
+    def pop(self):
+        """Removes and returns one random question row, or None if the bank is empty."""
+        with get_db() as conn:
+            while True:
+                with self._lock:
+                    if not self._ids:
+                        self._refill(conn)
+                        if not self._ids:
+                            return None
+                    qid = self._ids.pop()
+
+                q = conn.execute(f"DELETE FROM questions WHERE id = ? RETURNING {self.COLUMNS}", (qid,)).fetchone()
+                if q:
+                    self.counters['claimed'] += 1
+                    return q
+                # Already claimed by someone else (or wiped), try the next candidate
+                self.counters['missed'] += 1
+
+    def restore(self, q):
+        """Puts a claimed question back, e.g. when sending its poll failed."""
+        with get_db() as conn:
+            conn.execute(f"INSERT OR IGNORE INTO questions ({self.COLUMNS}) VALUES (?,?,?,?,?,?,?,?)", tuple(q))
+        self.counters['restored'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._ids = []
+
+    def stats(self):
+        return {**self.counters, 'buffered': len(self._ids)}
+
+question_pool = QuestionPool()
+
+# --- ACTIVE POLL REGISTRY ---
+# Answers to polls older than this are ignored and their rows purged
+ACTIVE_POLL_TTL_SECONDS = float(os.environ.get("ACTIVE_POLL_TTL_SECONDS", str(7 * 24 * 3600)))
+ACTIVE_POLL_CACHE_SIZE = int(os.environ.get("ACTIVE_POLL_CACHE_SIZE", "50000"))
+ACTIVE_POLL_PURGE_SECONDS = float(os.environ.get("ACTIVE_POLL_PURGE_SECONDS", "3600"))
+ACTIVE_POLL_PURGE_BATCH = 1000
+
+class PollRegistry:
+    """
+    LRU/TTL map of live quiz polls (poll_id -> chat_id, correct option) in front of
+    the `active_polls` table. The table stays the durable fallback after a restart;
+    purge_expired() keeps both bounded.
+    """
+    def __init__(self, ttl=ACTIVE_POLL_TTL_SECONDS, max_size=ACTIVE_POLL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._polls = OrderedDict()  # poll_id -> (chat_id, correct_option_id, created_at)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'db_hits': 0, 'expired': 0, 'evicted': 0, 'purged_rows': 0}
+
+    def _remember(self, poll_id, chat_id, correct_option_id, created_at):
+        with self._lock:
+            self._polls[poll_id] = (chat_id, correct_option_id, created_at)
+            self._polls.move_to_end(poll_id)
+            while len(self._polls) > self.max_size:
+                self._polls.popitem(last=False)
+                self.counters['evicted'] += 1
+
+    def register(self, poll_id, chat_id, correct_option_id):
+        self.register_many([(poll_id, chat_id, correct_option_id)])
+
+    def register_many(self, rows):
+        """Registers (poll_id, chat_id, correct_option_id) rows with one bulk insert."""
+        if not rows:
+            return
+        created_at = int(time.time())
+        statements = [(
+            "INSERT OR REPLACE INTO active_polls (poll_id, chat_id, correct_option_id, created_at) VALUES "
+            + ", ".join(["(?, ?, ?, ?)"] * len(chunk)),
+            [v for row in chunk for v in (*row, created_at)]
+        ) for chunk in _chunks(rows)]
+        with get_db() as conn:
+            conn.batch(statements)
+        for poll_id, chat_id, correct_option_id in rows:
+            self._remember(poll_id, chat_id, correct_option_id, created_at)
+
+    def get_cached(self, poll_id):
+        """(chat_id, correct_option_id) from memory, or None on a miss. Never touches the network."""
+        with self._lock:
+            entry = self._polls.get(poll_id)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl:
+                del self._polls[poll_id]
+                self.counters['expired'] += 1
+                return None
+            self._polls.move_to_end(poll_id)
+            self.counters['hits'] += 1
+            return entry[0], entry[1]
+
+    def lookup(self, poll_id):
+        """(chat_id, correct_option_id) for a live poll, falling back to the table."""
+        cached = self.get_cached(poll_id)
+        if cached is not None:
+            return cached
+        self.counters['misses'] += 1
+        with get_db() as conn:
+            row = conn.execute("SELECT chat_id, correct_option_id, created_at FROM active_polls WHERE poll_id = ?",
+                               (poll_id,)).fetchone()
+        if not row or (row[2] is not None and time.time() - row[2] > self.ttl):
+            return None
+        self.counters['db_hits'] += 1
+        self._remember(poll_id, row[0], row[1], row[2] or int(time.time()))
+        return row[0], row[1]
+
+    def purge_expired(self, batch_size=ACTIVE_POLL_PURGE_BATCH):
+        """Drops expired polls from memory, then deletes expired rows in batches. Returns rows deleted."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for poll_id in [p for p, entry in self._polls.items() if entry[2] < cutoff]:
+                del self._polls[poll_id]
+                self.counters['expired'] += 1
+
+        deleted = 0
+        with get_db() as conn:
+            while True:
+                cursor = conn.execute(
+                    "DELETE FROM active_polls WHERE rowid IN "
+                    "(SELECT rowid FROM active_polls WHERE created_at < ? LIMIT ?)",
+                    (int(cutoff), batch_size)
+                )
+                deleted += max(cursor.rowcount, 0)
+                if cursor.rowcount < batch_size:
+                    break
+        self.counters['purged_rows'] += deleted
+        return deleted
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {
+            **self.counters,
+            'size': len(self._polls),
+            'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+        }
+
+polls = PollRegistry()
+
+# --- COMPLIMENT STORE ---
+class ComplimentStore:
+    """
+    Global and per-group compliments held in memory as lists indexed by
+    (chat_id, type), chat_id None meaning global, so a random pick is O(1).
+    Every write goes to the table first and then updates the lists.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = {}  # id -> (type, text), backs /listcompliments and /delcompliment
+        self._texts = {}   # (chat_id or None, type) -> [text, ...]
+
+    def load(self):
+        with get_db() as conn:
+            global_rows, group_rows = conn.batch([
+                ("SELECT id, type, text FROM compliments", ()),
+                ("SELECT chat_id, type, text FROM group_compliments", ()),
+            ])
+        texts = {}
+        for r in group_rows:
+            texts.setdefault((r[0], r[1]), []).append(r[2])
+        with self._lock:
+            self._global = {r[0]: (r[1], r[2]) for r in global_rows}
+            self._texts = texts
+            self._rebuild_global()
+
+    def _rebuild_global(self):
+        for key in [k for k in self._texts if k[0] is None]:
+            del self._texts[key]
+        for c_type, text in self._global.values():
+            self._texts.setdefault((None, c_type), []).append(text)
+
+    def pick(self, chat_id, c_type):
+        """Random group compliment for this chat, falling back to a global one (or None)."""
+        texts = self._texts.get((chat_id, c_type)) or self._texts.get((None, c_type))
+        return random.choice(texts) if texts else None
+
+    def list_global(self):
+        """[(id, type, text), ...] ordered by id."""
+        return [(cid, c_type, text) for cid, (c_type, text) in sorted(self._global.items())]
+
+    def add(self, c_type, text):
+        with get_db() as conn:
+            cid = conn.execute("INSERT INTO compliments (type, text) VALUES (?,?) RETURNING id", (c_type, text)).fetchone()[0]
+        with self._lock:
+            self._global[cid] = (c_type, text)
+            self._texts.setdefault((None, c_type), []).append(text)
+        return cid
+
+    def delete(self, cid):
+        with get_db() as conn:
+            conn.execute("DELETE FROM compliments WHERE id = ?", (cid,))
+        with self._lock:
+            if self._global.pop(cid, None) is not None:
+                self._rebuild_global()
+
+    def delete_all(self):
+        with get_db() as conn:
+            conn.execute("DELETE FROM compliments")
+        with self._lock:
+            self._global = {}
+            self._rebuild_global()
+
+    def set_group(self, chat_id, c_type, text):
+        with get_db() as conn:
+            conn.batch([
+                # Delete old custom ones for this type in this group first to prevent spam
+                ("DELETE FROM group_compliments WHERE chat_id = ? AND type = ?", (chat_id, c_type)),
+                ("INSERT INTO group_compliments VALUES (?, ?, ?)", (chat_id, c_type, text)),
+            ])
+        with self._lock:
+            self._texts[(chat_id, c_type)] = [text]
+
+    def stats(self):
+        return {'global': len(self._global), 'groups': len({k[0] for k in self._texts if k[0] is not None})}
+
+compliments = ComplimentStore()
+
+# --- BROADCAST JOBS ---
+# Target states. A target is claimed (SENDING) before the message goes out, so a
+# crash mid-send leaves it SENDING and it is never delivered twice.
+TARGET_PENDING, TARGET_SENDING, TARGET_SENT, TARGET_FAILED = 0, 1, 2, 3
+
+BROADCAST_SOURCES = {
+    'bc_users': ["SELECT ?, user_id, 'user' FROM users"],
+    'bc_groups': ["SELECT ?, chat_id, 'group' FROM chats"],
+    'bc_all': ["SELECT ?, user_id, 'user' FROM users", "SELECT ?, chat_id, 'group' FROM chats"],
+}
+
+def create_broadcast(text, created_by):
+    """Persists a draft broadcast and returns its job id."""
     with get_db() as conn:
-        name_sql = """
-            COALESCE(
-                CASE WHEN u.username IS NOT NULL AND u.username != '' THEN '@' || u.username ELSE NULL END,
-                u.first_name,
-                'Participant ' || stats_table.user_id
-            ) AS display_name
-        """
+        return conn.execute(
+            "INSERT INTO broadcast_jobs (text, status, created_by, created_at) VALUES (?, 'draft', ?, ?) RETURNING job_id",
+            (text, created_by, datetime.now().isoformat())
+        ).fetchone()[0]
+
+def start_broadcast(job_id, target, status_chat_id, status_message_id):
+    """
+    Snapshots the audience of a draft into broadcast_targets and marks it running,
+    all in one transaction. Returns the target count, or None if the job is not a draft
+    (already started, cancelled or unknown).
+    """
+    statements = [
+        ("UPDATE broadcast_jobs SET status = 'running', target = ?, status_chat_id = ?, status_message_id = ? "
+         "WHERE job_id = ? AND status = 'draft' RETURNING job_id",
+         (target, status_chat_id, status_message_id, job_id)),
+    ]
+    # The audience is copied server-side; the guard makes a replayed click insert nothing
+    for source in BROADCAST_SOURCES[target]:
+        statements.append((
+            f"INSERT OR IGNORE INTO broadcast_targets (job_id, chat_id, kind) {source} "
+            "WHERE EXISTS (SELECT 1 FROM broadcast_jobs WHERE job_id = ? AND total = 0 AND status = 'running')",
+            (job_id, job_id)
+        ))
+    statements.append((
+        "UPDATE broadcast_jobs SET total = (SELECT COUNT(*) FROM broadcast_targets WHERE job_id = ?) "
+        "WHERE job_id = ? AND total = 0 RETURNING total",
+        (job_id, job_id)
+    ))
+    with get_db() as conn:
+        results = conn.batch(statements)
+    if not results[0]:
+        return None
+    return results[-1][0][0] if results[-1] else 0
+
+def cancel_broadcast(job_id):
+    with get_db() as conn:
+        conn.execute("UPDATE broadcast_jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'draft'",
+                     (datetime.now().isoformat(), job_id))
+
+def get_broadcast(job_id):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM broadcast_jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+def claim_broadcast_targets(job_id, limit):
+    """Atomically moves the next `limit` pending targets to SENDING and returns (chat_id, kind) pairs."""
+    with get_db() as conn:
+        return conn.execute(
+            "UPDATE broadcast_targets SET state = ? WHERE job_id = ? AND chat_id IN "
+            "(SELECT chat_id FROM broadcast_targets WHERE job_id = ? AND state = ? ORDER BY chat_id LIMIT ?) "
+            "RETURNING chat_id, kind",
+            (TARGET_SENDING, job_id, job_id, TARGET_PENDING, limit)
+        ).fetchall()
+
+def finish_broadcast_targets(job_id, results):
+    """Records the outcome of a claimed chunk: results are (chat_id, kind, ok) tuples."""
+    sent = [r[0] for r in results if r[2]]
+    failed = [r[0] for r in results if not r[2]]
+    users_ok = sum(1 for r in results if r[2] and r[1] == 'user')
+    statements = [(
+        "UPDATE broadcast_jobs SET users_ok = users_ok + ?, groups_ok = groups_ok + ?, failed = failed + ? WHERE job_id = ?",
+        (users_ok, len(sent) - users_ok, len(failed), job_id)
+    )]
+    for state, ids in ((TARGET_SENT, sent), (TARGET_FAILED, failed)):
+        for chunk in _chunks(ids, 500):
+            statements.append((
+                f"UPDATE broadcast_targets SET state = ? WHERE job_id = ? AND chat_id IN ({','.join('?' * len(chunk))})",
+                (state, job_id, *chunk)
+            ))
+    with get_db() as conn:
+        conn.batch(statements)
+
+def complete_broadcast(job_id):
+    """Marks a job done and drops its target rows; the counters on the job row are the record."""
+    with get_db() as conn:
+        conn.batch([
+            ("UPDATE broadcast_jobs SET status = 'done', finished_at = ? WHERE job_id = ?",
+             (datetime.now().isoformat(), job_id)),
+            ("DELETE FROM broadcast_targets WHERE job_id = ?", (job_id,)),
+        ])
+
+def recover_broadcasts():
+    """
+    Called at startup. Targets left SENDING by a crash may or may not have received
+    the message, so they are counted as failed rather than resent. Returns the ids of
+    jobs that still have work to do.
+    """
+    with get_db() as conn:
+        results = conn.batch([
+            ("UPDATE broadcast_jobs SET failed = failed + (SELECT COUNT(*) FROM broadcast_targets t "
+             "WHERE t.job_id = broadcast_jobs.job_id AND t.state = ?) WHERE status = 'running'",
+             (TARGET_SENDING,)),
+            ("UPDATE broadcast_targets SET state = ? WHERE state = ? AND job_id IN "
+             "(SELECT job_id FROM broadcast_jobs WHERE status = 'running')",
+             (TARGET_FAILED, TARGET_SENDING)),
+            ("SELECT job_id FROM broadcast_jobs WHERE status = 'running' ORDER BY job_id", ()),
+        ])
+    return [row[0] for row in results[-1]]
+
+# --- AUTO QUIZ TARGETS ---
+def get_quiz_groups():
+    """Group chat ids the auto quiz should reach (groups that failed permanently are skipped)."""
+    with get_db() as conn:
+        rows = conn.execute("SELECT chat_id FROM chats WHERE type != 'private' AND quiz_failed_at IS NULL").fetchall()
+    return [r[0] for r in rows]
+
+def mark_quiz_failed(chat_ids):
+    """Flags groups the bot can no longer post in, in one batch."""
+    now = datetime.now().isoformat()
+    statements = [(
+        f"UPDATE chats SET quiz_failed_at = ? WHERE chat_id IN ({','.join('?' * len(chunk))})",
+        (now, *chunk)
+    ) for chunk in _chunks(chat_ids, 500)]
+    if statements:
+        with get_db() as conn:
+            conn.batch(statements)
+
+LEADERBOARD_NAME_SQL = """
+    COALESCE(
+        CASE WHEN u.username IS NOT NULL AND u.username != '' THEN '@' || u.username ELSE NULL END,
+        u.first_name,
+        'Participant ' || stats_table.user_id
+    ) AS display_name
+"""
+
+def get_leaderboard_data(chat_id=None, limit=25, fresh=True):
+    with get_db(fresh) as conn:
         if chat_id:
-            query = f"SELECT {name_sql.replace('stats_table', 'gs')}, gs.attempted, gs.correct, gs.score FROM group_stats gs LEFT JOIN users u ON gs.user_id = u.user_id WHERE gs.chat_id = ? ORDER BY gs.score DESC LIMIT ?"
+            query = f"SELECT {LEADERBOARD_NAME_SQL.replace('stats_table', 'gs')}, gs.attempted, gs.correct, gs.score FROM group_stats gs LEFT JOIN users u ON gs.user_id = u.user_id WHERE gs.chat_id = ? ORDER BY gs.score DESC LIMIT ?"
             return conn.execute(query, (chat_id, limit)).fetchall()
         else:
-            query = f"SELECT {name_sql.replace('stats_table', 's')}, s.attempted, s.correct, s.score FROM stats s LEFT JOIN users u ON s.user_id = u.user_id ORDER BY s.score DESC LIMIT ?"
+            query = f"SELECT {LEADERBOARD_NAME_SQL.replace('stats_table', 's')}, s.attempted, s.correct, s.score FROM stats s LEFT JOIN users u ON s.user_id = u.user_id ORDER BY s.score DESC LIMIT ?"
             return conn.execute(query, (limit,)).fetchall()
 
-def delete_all_compliments():
+def get_nightly_leaderboards(limit=10, fresh=True):
+    """
+    Everything the nightly leaderboard needs in one round trip: the global top `limit`,
+    the target groups as (chat_id, title), and {chat_id: top `limit` rows} for every
+    group. Group rows are ranked with one window query and joined to users once;
+    they have the same shape as get_leaderboard_data rows.
+    """
+    global_query = f"SELECT {LEADERBOARD_NAME_SQL.replace('stats_table', 's')}, s.attempted, s.correct, s.score FROM stats s LEFT JOIN users u ON s.user_id = u.user_id ORDER BY s.score DESC LIMIT ?"
+    groups_query = f"""
+        WITH ranked AS (
+            SELECT gs.chat_id, gs.user_id, gs.attempted, gs.correct, gs.score,
+                   ROW_NUMBER() OVER (PARTITION BY gs.chat_id ORDER BY gs.score DESC) AS position
+            FROM group_stats gs
+        )
+        SELECT ranked.chat_id, {LEADERBOARD_NAME_SQL.replace('stats_table', 'ranked')},
+               ranked.attempted, ranked.correct, ranked.score
+        FROM ranked LEFT JOIN users u ON ranked.user_id = u.user_id
+        WHERE ranked.position <= ?
+        ORDER BY ranked.chat_id, ranked.position"""
+    with get_db(fresh) as conn:
+        global_rows, chats, group_rows = conn.batch([
+            (global_query, (limit,)),
+            ("SELECT chat_id, title FROM chats WHERE type != 'private' AND quiz_failed_at IS NULL", ()),
+            (groups_query, (limit,)),
+        ])
+    groups = {}
+    for r in group_rows:
+        groups.setdefault(r[0], []).append(tuple(r)[1:])
+    return global_rows, [(c[0], c[1]) for c in chats], groups
+
+# --- MIRROR TARGETS ---
+def get_mirror_targets(source_chat_id):
+    """Distinct user and group ids every mirrored post goes to (one query, read in lazy mode)."""
     with get_db() as conn:
-        conn.execute("DELETE FROM compliments")
+        rows = conn.iterate("SELECT user_id FROM users UNION SELECT chat_id FROM chats WHERE chat_id != ?",
+                            (source_chat_id,))
+        return [r[0] for r in rows]
+
+def prune_chats(chat_ids):
+    """Deletes users and chats the bot can no longer reach, in one batch."""
+    statements = []
+    for chunk in _chunks(chat_ids, 500):
+        placeholders = ','.join('?' * len(chunk))
+        statements.append((f"DELETE FROM users WHERE user_id IN ({placeholders})", chunk))
+        statements.append((f"DELETE FROM chats WHERE chat_id IN ({placeholders})", chunk))
+    if statements:
+        with get_db() as conn:
+            conn.batch(statements)
+
+def insert_questions(rows):
+    """
+    Bulk insert of (question, a, b, c, d, correct, explanation) tuples: multi-row
+    inserts of 100 questions, all in one batch (one round trip, one transaction).
+    """
+    statements = [(
+        "INSERT INTO questions (question, a, b, c, d, correct, explanation) VALUES "
+        + ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk)),
+        [v for row in chunk for v in row]
+    ) for chunk in _chunks(rows)]
+    if statements:
+        with get_db() as conn:
+            conn.batch(statements)
+
+def delete_all_compliments():
+    compliments.delete_all()
 
 def delete_all_questions():
     with get_db() as conn:
         conn.execute("DELETE FROM questions")
+    question_pool.clear()
+
+# --- METRICS ---
+def _pool_gauge():
+    stats = pool.stats()
+    return {('in_use',): stats['in_use'], ('idle',): stats['idle']}
+
+# For the SQLite backend 'idle' counts the per-thread reader connections
+metrics.gauge('neetiq_db_pool_clients', 'Storage backend clients by state', _pool_gauge, ['state'])
+metrics.gauge('neetiq_replica_lag_seconds', 'Seconds since the local read replica last synced (-1 = not synced)',
+              lambda: {(): replica.lag_seconds if replica.lag_seconds is not None else -1} if replica.enabled else {})
+metrics.gauge('neetiq_stats_buffer_pending', 'Buffered poll answers not yet flushed',
+              lambda: {(): stats_buffer.stats()['pending']})
+metrics.gauge('neetiq_cache_entries', 'Entries held by the in-memory caches', lambda: {
+    ('admins',): len(admins),
+    ('active_polls',): polls.stats()['size'],
+    ('question_pool',): question_pool.stats()['buffered'],
+    ('compliments',): compliments.stats()['global'],
+    ('global_ranks',): len(global_ranks),
+    ('group_ranks',): len(group_ranks),
+}, ['cache'])
+metrics.stats_gauge('neetiq_db_pool', 'Storage backend counters (created/reused/discarded clients, health checks, ...)',
+                    pool.stats)
+metrics.stats_gauge('neetiq_poll_registry', 'Active poll registry counters and hit rate', polls.stats)
+metrics.stats_gauge('neetiq_question_pool', 'Question pool refills, claims and buffered candidates', question_pool.stats)
+metrics.stats_gauge('neetiq_stats_buffer', 'Write-behind stats buffer counters', stats_buffer.stats)
+metrics.stats_gauge('neetiq_replica', 'Local read replica syncs and reads', replica.stats)
 
 if __name__ == "__main__":
     init_db()
+    # Pooled clients run on non-daemon threads (and SQLite files hold locks), close them so the script can exit
+    pool.close()
+    _executor.shutdown()
 
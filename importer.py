@@ -0,0 +1,125 @@
+import os
+import csv
+import json
+
+# --- QUESTION IMPORT ---
+# Questions written per batch transaction
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+# Minimum gap between progress message edits
+IMPORT_PROGRESS_SECONDS = float(os.environ.get("IMPORT_PROGRESS_SECONDS", "5"))
+
+VALID_CORRECT = {'1', '2', '3', '4', 'A', 'B', 'C', 'D'}
+FIELDS = ('question', 'a', 'b', 'c', 'd', 'correct', 'explanation')
+# File extension -> parser format
+FORMATS = {'.txt': 'blocks', '.csv': 'csv', '.json': 'json', '.jsonl': 'json'}
+
+
+def format_for(file_name):
+    """Parser format for an uploaded file name, or None if it is not supported."""
+    return FORMATS.get(os.path.splitext(file_name or '')[1].lower())
+
+def make_row(question, a, b, c, d, correct, explanation):
+    """Validated (question, a, b, c, d, correct, explanation) tuple, or None to skip it."""
+    values = [str(v).strip() if v is not None else '' for v in (question, a, b, c, d, correct, explanation)]
+    # Normalize answer: trim spaces and make uppercase (e.g., 'a ' -> 'A')
+    values[5] = values[5].upper()
+    if not all(values[:5]) or values[5] not in VALID_CORRECT:
+        return None
+    return tuple(values)
+
+
+# ---------------- PARSERS ----------------
+# Each parser reads a text stream incrementally and yields one row tuple per
+# question, or None for an entry that failed validation.
+
+def parse_blocks(stream):
+    """
+    The original 7-line format: question (one or more lines), options A-D, the
+    correct option and the explanation, with blocks separated by blank lines.
+    """
+    lines = []
+    for line in stream:
+        line = line.strip()
+        if line:
+            lines.append(line)
+            continue
+        if lines:
+            yield _block_row(lines)
+            lines = []
+    if lines:
+        yield _block_row(lines)
+
+def _block_row(lines):
+    if len(lines) < 7:
+        return None
+    return make_row("\n".join(lines[:-6]), *lines[-6:])
+
+def parse_csv(stream):
+    """CSV with a header row naming the question, a, b, c, d, correct and explanation columns."""
+    reader = csv.reader(stream)
+    header = [h.strip().lower() for h in next(reader, [])]
+    missing = [f for f in FIELDS[:6] if f not in header]
+    if missing:
+        raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+    index = [header.index(f) if f in header else None for f in FIELDS]
+    for record in reader:
+        if not any(cell.strip() for cell in record):
+            continue
+        yield make_row(*(record[i] if i is not None and i < len(record) else '' for i in index))
+
+def parse_json(stream, chunk_size=1 << 16):
+    """A JSON array of question objects, or one object per line (JSON Lines)."""
+    for item in _iter_json(stream, chunk_size):
+        yield make_row(*(item.get(f) for f in FIELDS)) if isinstance(item, dict) else None
+
+def _iter_json(stream, chunk_size):
+    """Decodes top-level array items (or concatenated values) without loading the whole document."""
+    decoder = json.JSONDecoder()
+    buf, eof, in_array = '', False, None
+    while True:
+        buf = buf.lstrip()
+        if buf:
+            if in_array is None:
+                in_array = buf[0] == '['
+                if in_array:
+                    buf = buf[1:]
+                    continue
+            if in_array and buf[0] == ',':
+                buf = buf[1:]
+                continue
+            if in_array and buf[0] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError("Malformed JSON near: " + buf[:40])
+            else:
+                yield item
+                buf = buf[end:]
+                continue
+        elif eof:
+            return
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+
+PARSERS = {'blocks': parse_blocks, 'csv': parse_csv, 'json': parse_json}
+
+def parse(stream, fmt):
+    return PARSERS[fmt](stream)
+
+def take(rows, size=IMPORT_BATCH_SIZE):
+    """
+    Pulls up to `size` valid rows from a parser.
+    Returns (batch, skipped, finished).
+    """
+    batch, skipped = [], 0
+    for row in rows:
+        if row is None:
+            skipped += 1
+            continue
+        batch.append(row)
+        if len(batch) >= size:
+            return batch, skipped, False
+    return batch, skipped, True
@@ -1,7 +1,11 @@
+import signal
 import logging
 import asyncio
+from collections import deque, OrderedDict
 import pytz 
 import html
+import io
+import tempfile
 from html import escape
 from telegram.constants import ParseMode
 from datetime import datetime, time
@@ -18,6 +22,10 @@ from telegram.ext import (
     Defaults
 )
 import database as db
+import importer
+import metrics
+import sender
+import webserver
 
 
 # ---------------- CONFIG ----------------
@@ -28,6 +36,10 @@ import os
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 OWNER_ID = int(os.environ.get("OWNER_ID", "6435499094"))
 SOURCE_GROUP_ID = int(os.environ.get("SOURCE_GROUP_ID", "-1003729584653"))
+# Updates handled at the same time (PTB's default of 1 lets one slow handler stall the bot).
+# Handlers only share state that is touched synchronously on the event loop or behind
+# locks in database.py, so they are safe to interleave.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "32"))
 
 # Logging setup
 logging.basicConfig(
@@ -43,17 +55,73 @@ defaults = Defaults(parse_mode="Markdown")
 # --- NEW CONFIG & HELPERS ---
 REQUIRED_CHANNELS = ["@NEETIQBOTUPDATES", "@SANSKAR279"]
 
-async def check_force_join(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Returns True if user joined all required channels."""
-    for channel in REQUIRED_CHANNELS:
-        try:
-            member = await context.bot.get_chat_member(chat_id=channel, user_id=user_id)
-            if member.status in ['left', 'kicked']:
-                return False
-        except Exception:
-            # If bot is not admin in channel, this might fail, so we skip
-            continue
-    return True
+# How long a membership answer is trusted before asking Telegram again
+FORCE_JOIN_MEMBER_TTL = float(os.environ.get("FORCE_JOIN_MEMBER_TTL", "3600"))
+FORCE_JOIN_NOT_MEMBER_TTL = float(os.environ.get("FORCE_JOIN_NOT_MEMBER_TTL", "30"))
+FORCE_JOIN_CACHE_SIZE = int(os.environ.get("FORCE_JOIN_CACHE_SIZE", "50000"))
+
+class MembershipCache:
+    """
+    (user_id, channel) -> (joined, expires_at), used only from the event loop.
+    Joined users are trusted for FORCE_JOIN_MEMBER_TTL; "not joined" answers expire
+    quickly so someone who just joined isn't locked out for long.
+    """
+    def __init__(self, max_size=FORCE_JOIN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.counters = {'hits': 0, 'misses': 0, 'api_calls': 0, 'api_errors': 0}
+
+    def get(self, user_id, channel, recheck=False):
+        """Cached answer, or None when Telegram has to be asked (recheck ignores cached negatives)."""
+        entry = self._entries.get((user_id, channel))
+        if entry is None or entry[1] < time.monotonic() or (recheck and not entry[0]):
+            self.counters['misses'] += 1
+            return None
+        self.counters['hits'] += 1
+        return entry[0]
+
+    def put(self, user_id, channel, joined):
+        ttl = FORCE_JOIN_MEMBER_TTL if joined else FORCE_JOIN_NOT_MEMBER_TTL
+        key = (user_id, channel)
+        self._entries[key] = (joined, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {**self.counters, 'entries': len(self._entries),
+                'hit_rate': self.counters['hits'] / lookups if lookups else 0.0,
+                # Every hit is a get_chat_member call that didn't happen
+                'api_calls_saved': self.counters['hits']}
+
+membership_cache = MembershipCache()
+
+async def _is_channel_member(bot, channel, user_id, recheck):
+    joined = membership_cache.get(user_id, channel, recheck)
+    if joined is not None:
+        return joined
+    membership_cache.counters['api_calls'] += 1
+    try:
+        member = await bot.get_chat_member(chat_id=channel, user_id=user_id)
+    except Exception:
+        # If bot is not admin in channel, this might fail, so we skip (and don't cache)
+        membership_cache.counters['api_errors'] += 1
+        return True
+    joined = member.status not in ['left', 'kicked']
+    membership_cache.put(user_id, channel, joined)
+    return joined
+
+async def check_force_join(user_id: int, context: ContextTypes.DEFAULT_TYPE, recheck: bool = False) -> bool:
+    """
+    Returns True if user joined all required channels.
+    Channels are checked concurrently; recheck=True (the "Verify access" button)
+    asks Telegram again for channels the user was recently missing from.
+    """
+    results = await asyncio.gather(*(
+        _is_channel_member(context.bot, channel, user_id, recheck) for channel in REQUIRED_CHANNELS
+    ))
+    return all(results)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a notice to the owner."""
@@ -73,56 +141,107 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         pass # If we can't even message the owner, just give up
 		
 
+# --- BACKGROUND WORK ---
+# Broadcasts, question imports and mirror fan-outs started from handlers or at startup.
+# Application.stop() waits for every create_task() task, so a stop cancels these first
+# (see prepare_shutdown); broadcasts resume from the database after the restart.
+background_tasks = set()
+
+def run_in_background(application, coroutine):
+    task = application.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "30"))  # sends in flight
+BROADCAST_CHUNK = int(os.environ.get("BROADCAST_CHUNK", "200"))              # targets claimed per DB round trip
+BROADCAST_PROGRESS_SECONDS = 10
+BROADCAST_DIVIDER = "<b>━━━━━━━━━━━━━━━━━━━━</b>"
+
+def broadcast_report(job, title):
+    return (
+        f"{title}\n"
+        f"{BROADCAST_DIVIDER}\n"
+        f"👤 <b>Users:</b> <code>{job['users_ok']}</code> | 👥 <b>Groups:</b> <code>{job['groups_ok']}</code>\n"
+        f"⚠️ <b>Failed:</b> <code>{job['failed']}</code>\n"
+        f"📦 <b>Progress:</b> <code>{job['users_ok'] + job['groups_ok'] + job['failed']}/{job['total']}</code>\n"
+        f"{BROADCAST_DIVIDER}"
+    )
+
+async def run_broadcast_job(bot, job_id):
+    """
+    Delivers a persisted broadcast in claimed chunks with bounded concurrency.
+    Progress lives in the database, so the job resumes after a restart.
+    """
+    job = await db.run(db.get_broadcast, job_id)
+    if not job or job['status'] != 'running':
+        return
+    text = f"📢 <b>NEETIQ ANNOUNCEMENT</b>\n{BROADCAST_DIVIDER}\n\n{job['text']}\n\n{BROADCAST_DIVIDER}"
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def deliver(chat_id, kind):
+        async with semaphore:
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", rate_limit_args=sender.BULK)
+                return chat_id, kind, True
+            except Exception:
+                return chat_id, kind, False
+
+    async def show(title):
+        try:
+            await bot.edit_message_text(broadcast_report(await db.run(db.get_broadcast, job_id), title),
+                                        chat_id=job['status_chat_id'], message_id=job['status_message_id'],
+                                        parse_mode="HTML", rate_limit_args=sender.JOBS)
+        except Exception:
+            pass  # Unchanged text or deleted status message
+
+    started = last_progress = time.monotonic()
+    sent = failed = 0
+    while True:
+        targets = await db.run(db.claim_broadcast_targets, job_id, BROADCAST_CHUNK)
+        if not targets:
+            break
+        results = await asyncio.gather(*(deliver(t[0], t[1]) for t in targets))
+        await db.run(db.finish_broadcast_targets, job_id, results)
+        ok = sum(1 for r in results if r[2])
+        sent, failed = sent + ok, failed + len(results) - ok
+        if time.monotonic() - last_progress >= BROADCAST_PROGRESS_SECONDS:
+            last_progress = time.monotonic()
+            await show("⏳ <b>BROADCASTING...</b>")
+
+    await db.run(db.complete_broadcast, job_id)
+    metrics.record_job('broadcast', started, sent=sent, failed=failed)
+    await show("✅ <b>BROADCAST COMPLETE</b>")
+
+async def resume_broadcasts(application):
+    """Restarts broadcasts that were interrupted by a restart."""
+    for job_id in await db.run(db.recover_broadcasts):
+        print(f"🔁 Resuming broadcast #{job_id}")
+        run_in_background(application, run_broadcast_job(application.bot, job_id))
+
 async def handle_broadcast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handles the target selection and execution of the broadcast."""
+    """Handles the target selection and starts the broadcast in the background."""
     query = update.callback_query
+    target, _, job_id = query.data.partition(':')
+
+    # The buttons may be visible to a whole group: only the admin who drafted it may press them
+    job = await db.run(db.get_broadcast, int(job_id)) if job_id.isdigit() else None
+    if job is None or job['created_by'] != query.from_user.id:
+        return await query.answer("⛔ Only the admin who created this broadcast can do that.", show_alert=True)
     await query.answer()
-    
-    target = query.data
-    msg_text = context.user_data.get('broadcast_msg')
 
-    if target == "bc_cancel" or not msg_text:
+    job_id = int(job_id)
+    if target == "bc_cancel":
+        await db.run(db.cancel_broadcast, job_id)
         return await query.edit_message_text("❌ <b>Broadcast cancelled.</b>", parse_mode="HTML")
 
-    await query.edit_message_text("⏳ <b>Broadcasting... please wait.</b>", parse_mode="HTML")
+    total = await db.run(db.start_broadcast, job_id, target, query.message.chat_id, query.message.message_id)
+    if total is None:
+        return await query.edit_message_text("⚠️ <b>This broadcast was already started or cancelled.</b>", parse_mode="HTML")
 
-    # Fetch IDs based on selection
-    with db.get_db() as conn:
-        users = conn.execute("SELECT user_id FROM users").fetchall() if target in ["bc_users", "bc_all"] else []
-        groups = conn.execute("SELECT chat_id FROM chats").fetchall() if target in ["bc_groups", "bc_all"] else []
-
-    u_ok, g_ok, u_fail, g_fail = 0, 0, 0, 0
-    divider = "<b>━━━━━━━━━━━━━━━━━━━━</b>"
-    header = f"📢 <b>NEETIQ ANNOUNCEMENT</b>\n{divider}\n\n"
-
-    # Send to Users
-    for u in users:
-        try:
-            await context.bot.send_message(chat_id=u[0], text=f"{header}{msg_text}\n\n{divider}", parse_mode="HTML")
-            u_ok += 1
-            await asyncio.sleep(0.05)
-        except: u_fail += 1
-
-    # Send to Groups
-    for g in groups:
-        try:
-            await context.bot.send_message(chat_id=g[0], text=f"{header}{msg_text}\n\n{divider}", parse_mode="HTML")
-            g_ok += 1
-            await asyncio.sleep(0.05)
-        except: g_fail += 1
-
-    # Final Report
-    report = (
-        f"✅ <b>BROADCAST COMPLETE</b>\n"
-        f"{divider}\n"
-        f"👤 <b>Users:</b> <code>{u_ok}</code> | 👥 <b>Groups:</b> <code>{g_ok}</code>\n"
-        f"⚠️ <b>Failed:</b> <code>{u_fail + g_fail}</code>\n"
-        f"{divider}"
-    )
-    await query.message.edit_text(report, parse_mode="HTML")
-    # Clean up memory
-    if 'broadcast_msg' in context.user_data:
-        del context.user_data['broadcast_msg']
+    await query.edit_message_text(f"⏳ <b>Broadcasting to {total} chats...</b>", parse_mode="HTML")
+    # Runs outside the handler so the bot keeps answering while it sends
+    run_in_background(context.application, run_broadcast_job(context.bot, job_id))
 		
 # ---------------- HELPERS ----------------
 MAX_MESSAGE_LENGTH = 4000  # Safe limit
@@ -134,25 +253,14 @@ def split_message(text, max_length=MAX_MESSAGE_LENGTH):
     ]
 
 def apply_footer(text: str) -> str:
-    """Applies the professional divider and custom footer text."""
-    with db.get_db() as conn:
-        f_row = conn.execute("SELECT value FROM settings WHERE key='footer_text'").fetchone()
-        f_en = conn.execute("SELECT value FROM settings WHERE key='footer_enabled'").fetchone()
-    
-    footer_text = f_row[0] if f_row else "NEETIQBot"
-    enabled = f_en[0] if f_en else "1"
-    
-    if enabled == '1':
-        return f"{text}\n\n━━━━━━━━━━━━━━━━━━━\n{footer_text}"
+    """Applies the professional divider and custom footer text (from the settings cache)."""
+    if db.settings.footer_enabled:
+        return f"{text}\n\n━━━━━━━━━━━━━━━━━━━\n{db.settings.footer_text}"
     return text
 
 async def is_admin(user_id: int) -> bool:
-    """Check if a user has admin privileges or is the owner."""
-    if user_id == OWNER_ID:
-        return True
-    with db.get_db() as conn:
-        res = conn.execute("SELECT 1 FROM admins WHERE user_id=?", (user_id,)).fetchone()
-        return res is not None
+    """Check if a user has admin privileges or is the owner (served from the admin cache)."""
+    return user_id == OWNER_ID or user_id in db.admins
 
 # ---------------- REGISTRATION ----------------
 
@@ -168,16 +276,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     safe_name = html.escape(user.first_name)
     
     # Database Logic
-    with db.get_db() as conn:
-        conn.execute(
-            "INSERT OR IGNORE INTO users (user_id, username, first_name, joined_at) VALUES (?,?,?,?)",
-            (user.id, user.username, user.first_name, str(datetime.now()))
-        )
-        if chat.type != 'private':
-            conn.execute(
-                "INSERT OR IGNORE INTO chats (chat_id, type, title, added_at) VALUES (?,?,?,?)",
-                (chat.id, chat.type, chat.title, str(datetime.now()))
-            )
+    statements = [(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name, joined_at) VALUES (?,?,?,?)",
+        (user.id, user.username, user.first_name, str(datetime.now()))
+    )]
+    if chat.type != 'private':
+        statements.append((
+            "INSERT OR IGNORE INTO chats (chat_id, type, title, added_at) VALUES (?,?,?,?)",
+            (chat.id, chat.type, chat.title, str(datetime.now()))
+        ))
+        # The bot can post here again, so put the group back on the auto quiz
+        statements.append(("UPDATE chats SET quiz_failed_at = NULL WHERE chat_id = ?", (chat.id,)))
+    await db.batch(statements)
 
     if chat.type == 'private':
         welcome = (
@@ -236,9 +346,8 @@ async def send_random_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a random NEET MCQ and permanently deletes it from the DB to prevent repetition."""
     chat_id = update.effective_chat.id
     
-    with db.get_db() as conn:
-        # 1. Fetch any random question currently in the database
-        q = conn.execute("SELECT * FROM questions ORDER BY RANDOM() LIMIT 1").fetchone()
+    # 1. Claim a random question (it is removed from the bank so it can never repeat)
+    q = await db.run(db.question_pool.pop)
 
     if not q:
         # No need to reset sent_questions because we are deleting questions permanently
@@ -253,6 +362,7 @@ async def send_random_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     correct_map = {'1': 0, '2': 1, '3': 2, '4': 3, 'A': 0, 'B': 1, 'C': 2, 'D': 3}
     c_idx = correct_map.get(str(q['correct']).upper(), 0)
 
+    msg = None
     try:
         # 2. Send the Poll
         msg = await context.bot.send_poll(
@@ -265,16 +375,14 @@ async def send_random_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
             is_anonymous=False
         )
         
-        # 3. Track poll for answers and IMMEDIATELY delete the question
-        with db.get_db() as conn:
-            # Save poll info so /myscore works
-            conn.execute("INSERT INTO active_polls VALUES (?,?,?)", (msg.poll.id, chat_id, c_idx))
-            
-            # Delete the question by ID so it can never be sent again
-            conn.execute("DELETE FROM questions WHERE id = ?", (q['id'],))
+        # 3. Save poll info so /myscore works
+        await db.run(db.polls.register, msg.poll.id, chat_id, c_idx)
             
     except Exception as e:
         logger.error(f"Error in Quiz Flow: {e}")
+        if msg is None:
+            # The poll never went out, give the question back to the bank
+            await db.run(db.question_pool.restore, q)
         await update.message.reply_text("❌ Failed to process the quiz. Please check database logs.")
 
 async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -290,20 +398,11 @@ async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
     username = user.username
     first_name = user.first_name
 
-    # 1. Sync User and Fetch Poll Data
-    with db.get_db() as conn:
-        conn.execute("""
-            INSERT INTO users (user_id, username, first_name)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username = excluded.username,
-                first_name = excluded.first_name
-        """, (user_id, username, first_name))
-        
-        poll_data = conn.execute(
-            "SELECT chat_id, correct_option_id FROM active_polls WHERE poll_id = ?", 
-            (poll_id,)
-        ).fetchone()
+    # 1. Fetch Poll Data (memory first, active_polls table on a miss)
+    # The user profile sync rides along with the buffered stats write below
+    poll_data = db.polls.get_cached(poll_id)
+    if poll_data is None:
+        poll_data = await db.run(db.polls.lookup, poll_id)
 
     if not poll_data:
         return
@@ -312,35 +411,21 @@ async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
     correct_option = poll_data[1]
     is_correct = (len(answer.option_ids) > 0 and answer.option_ids[0] == correct_option)
 
-    # 2. Update Stats
-    db.update_user_stats(user_id, chat_id, is_correct, username=username, first_name=first_name)
+    # 2. Update Stats (buffered in memory, written by flush_stats_job)
+    if db.update_user_stats(user_id, chat_id, is_correct, username=username, first_name=first_name):
+        context.application.create_task(flush_stats_job(context))
 
     # 3. Stable Compliment Logic
-    with db.get_db() as conn:
-        # Check if enabled
-        setting = conn.execute(
-            "SELECT compliments_enabled FROM group_settings WHERE chat_id = ?", 
-            (chat_id,)
-        ).fetchone()
-        if setting and setting[0] == 0:
-            return
-
-        c_type = "correct" if is_correct else "wrong"
-
-        # Split query for Turso stability: Try group first, then global
-        comp = conn.execute(
-            "SELECT text FROM group_compliments WHERE chat_id = ? AND type = ? ORDER BY RANDOM() LIMIT 1",
-            (chat_id, c_type)
-        ).fetchone()
-
-        if not comp:
-            comp = conn.execute(
-                "SELECT text FROM compliments WHERE type = ? ORDER BY RANDOM() LIMIT 1",
-                (c_type,)
-            ).fetchone()
-
-    if comp:
-        compliment_text = comp[0]
+    # Check if enabled
+    if not db.settings.group_compliments_enabled(chat_id):
+        return
+
+    c_type = "correct" if is_correct else "wrong"
+
+    # In-memory pick: group compliment first, then global
+    compliment_text = db.compliments.pick(chat_id, c_type)
+
+    if compliment_text:
         safe_name = html.escape(first_name)
         
         # Format mention
@@ -351,17 +436,22 @@ async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE)
             
         final_text = compliment_text.replace("{user}", mention_name)
 
-        # Only broadcast in groups
-        if chat_id < 0:
-            try:
-                await context.bot.send_message(
-                    chat_id=chat_id, 
-                    text=final_text, 
-                    parse_mode="HTML",
-                    disable_web_page_preview=True
-                )
-            except Exception as e:
-                print(f"Error sending compliment: {e}")
+        # Only broadcast in groups. Compliments are optional: skip them when the group's
+        # send budget is used up, and never make the answer handler wait for the send
+        if chat_id < 0 and sender.send_scheduler.has_capacity(chat_id):
+            context.application.create_task(send_compliment(context.bot, chat_id, final_text))
+
+async def send_compliment(bot, chat_id, text):
+    try:
+        await bot.send_message(
+            chat_id=chat_id, 
+            text=text, 
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+            rate_limit_args=sender.JOBS
+        )
+    except Exception as e:
+        print(f"Error sending compliment: {e}")
 				
 # ---------------- PERFORMANCE STATS ----------------
 
@@ -370,23 +460,19 @@ async def myscore(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
     
-    with db.get_db() as conn:
-        # Fetch user stats
-        s = conn.execute("SELECT * FROM stats WHERE user_id = ?", (user.id,)).fetchone()
-        
-        if not s:
-            return await update.message.reply_text("❌ <b>No data found.</b> Participate in a quiz to generate stats!", parse_mode="HTML")
+    # Fetch user stats
+    s = await db.fetchone("SELECT * FROM stats WHERE user_id = ?", (user.id,), fresh=False)
+    
+    if not s:
+        return await update.message.reply_text("❌ <b>No data found.</b> Participate in a quiz to generate stats!", parse_mode="HTML")
 
-        # Calculate Global Rank
-        g_rank_row = conn.execute("SELECT COUNT(*) + 1 FROM stats WHERE score > ?", (s['score'],)).fetchone()
-        global_rank = g_rank_row[0]
+    # Calculate Global Rank (in-memory rank index)
+    global_rank = db.global_ranks.rank_of(user.id) or "N/A"
 
-        # Calculate Group Rank (if in a group)
-        group_rank = "N/A"
-        if chat.type != 'private':
-            gr_row = conn.execute("SELECT COUNT(*) + 1 FROM group_stats WHERE chat_id = ? AND score > ?", 
-                                 (chat.id, s['score'])).fetchone()
-            group_rank = gr_row[0] if gr_row else "N/A"
+    # Calculate Group Rank (if in a group), using the user's score in THIS group
+    group_rank = "N/A"
+    if chat.type != 'private':
+        group_rank = db.group_ranks.rank_of(chat.id, user.id) or "N/A"
 
     # Calculations
     attempted = s['attempted']
@@ -437,17 +523,17 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # We split by space but only 1 time to keep the rest of the text intact
     msg_to_send = full_text.split(None, 1)[1]
     
-    # Store in user_data for the callback handler to use later
-    context.user_data['broadcast_msg'] = msg_to_send
+    # Persist it as a draft job so the broadcast survives a restart
+    job_id = await db.run(db.create_broadcast, msg_to_send, update.effective_user.id)
 
     # 3. Target selection menu
     buttons = [
         [
-            InlineKeyboardButton("👤 Users Only", callback_data="bc_users"),
-            InlineKeyboardButton("👥 Groups Only", callback_data="bc_groups")
+            InlineKeyboardButton("👤 Users Only", callback_data=f"bc_users:{job_id}"),
+            InlineKeyboardButton("👥 Groups Only", callback_data=f"bc_groups:{job_id}")
         ],
-        [InlineKeyboardButton("🌎 Both (Users + Groups)", callback_data="bc_all")],
-        [InlineKeyboardButton("❌ Cancel", callback_data="bc_cancel")]
+        [InlineKeyboardButton("🌎 Both (Users + Groups)", callback_data=f"bc_all:{job_id}")],
+        [InlineKeyboardButton("❌ Cancel", callback_data=f"bc_cancel:{job_id}")]
     ]
     
     await update.message.reply_text(
@@ -475,7 +561,7 @@ async def mystats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     # 2. Force Join Check
-    is_joined = await check_force_join(user.id, context)
+    is_joined = await check_force_join(user.id, context, recheck=bool(query))
     if not is_joined:
         if query:
             await query.answer("⚠️ Join the channels first!", show_alert=True)
@@ -494,26 +580,28 @@ async def mystats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try: await query.message.delete()
         except: pass
 
-    # 3. Data Fetching
-    with db.get_db() as conn:
+    # 3. Data Fetching (one round trip, replica is fine: stats are flushed in batches anyway)
+    results = await db.batch([
         # Global Stats
-        s = conn.execute("SELECT * FROM stats WHERE user_id = ?", (user.id,)).fetchone()
+        ("SELECT * FROM stats WHERE user_id = ?", (user.id,)),
         # Daily Stats
-        d = conn.execute("SELECT * FROM daily_stats WHERE user_id = ? AND day = ?", (user.id, today_date)).fetchone()
-        
-        if not s:
-            msg = "❌ <b>No data found!</b> Solve a quiz to start tracking."
-            return await context.bot.send_message(chat_id=user.id, text=msg, parse_mode="HTML")
-
-        # Global Data
-        att, corr, score, c_streak, m_streak = s['attempted'], s['correct'], s['score'], s['current_streak'], s['max_streak']
-        # Daily Data
-        d_att = d['attempted'] if d else 0
-        d_corr = d['correct'] if d else 0
-        d_acc = (d_corr / d_att * 100) if d_att > 0 else 0
-        # Rank Calculation
-        g_rank_row = conn.execute("SELECT COUNT(*) + 1 FROM stats WHERE score > ?", (score,)).fetchone()
-        global_rank = g_rank_row[0]
+        ("SELECT * FROM daily_stats WHERE user_id = ? AND day = ?", (user.id, today_date)),
+    ], fresh=False)
+    s = results[0][0] if results[0] else None
+    d = results[1][0] if results[1] else None
+    
+    if not s:
+        msg = "❌ <b>No data found!</b> Solve a quiz to start tracking."
+        return await context.bot.send_message(chat_id=user.id, text=msg, parse_mode="HTML")
+
+    # Global Data
+    att, corr, score, c_streak, m_streak = s['attempted'], s['correct'], s['score'], s['current_streak'], s['max_streak']
+    # Daily Data
+    d_att = d['attempted'] if d else 0
+    d_corr = d['correct'] if d else 0
+    d_acc = (d_corr / d_att * 100) if d_att > 0 else 0
+    # Rank Calculation (in-memory rank index)
+    global_rank = db.global_ranks.rank_of(user.id) or "N/A"
 
     # 4. Logic & Ranking
     accuracy = (corr / att * 100) if att > 0 else 0
@@ -581,7 +669,7 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Redesigned Global Leaderboard: Uniform format for all ranks."""
     try:
         # Fetch top 10 rows
-        rows = db.get_leaderboard_data(limit=10) 
+        rows = await db.run(db.get_leaderboard_data, limit=10, fresh=False)
         
         if not rows:
             return await update.message.reply_text("<b>📭 The Global Arena is currently empty!</b>", parse_mode="HTML")
@@ -619,7 +707,7 @@ async def groupleaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         chat_id = update.effective_chat.id
-        rows = db.get_leaderboard_data(chat_id=chat_id, limit=10)
+        rows = await db.run(db.get_leaderboard_data, chat_id=chat_id, limit=10, fresh=False)
         title = html.escape(update.effective_chat.title or "Group")
         
         divider = "<b>━━━━━━━━━━━━━━━━━━━━</b>"
@@ -658,23 +746,18 @@ async def groupleaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def adminlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Lists all authorized admins."""
     if not await is_admin(update.effective_user.id): return
-    with db.get_db() as conn:
-        admins = conn.execute("SELECT user_id FROM admins").fetchall()
-    
     text = "👮 *Authorized Admins:*\n\n"
     text += f"• `{OWNER_ID}` (Owner)\n"
-    for adm in admins:
-        if adm[0] != OWNER_ID:
-            text += f"• `{adm[0]}`\n"
+    for adm in db.admins.ids():
+        if adm != OWNER_ID:
+            text += f"• `{adm}`\n"
     await update.message.reply_text(apply_footer(text))
 
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID: return
     try:
         new_id = int(context.args[0])
-        with db.get_db() as conn:
-            conn.execute("INSERT OR IGNORE INTO admins (user_id, added_at) VALUES (?,?)", 
-                         (new_id, str(datetime.now())))
+        await db.run(db.admins.add, new_id)
         await update.message.reply_text(f"✅ User `{new_id}` is now an Admin.")
     except:
         await update.message.reply_text("❌ Usage: `/addadmin <user_id>`")
@@ -683,8 +766,7 @@ async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID: return
     try:
         rem_id = int(context.args[0])
-        with db.get_db() as conn:
-            conn.execute("DELETE FROM admins WHERE user_id = ?", (rem_id,))
+        await db.run(db.admins.remove, rem_id)
         await update.message.reply_text(f"✅ User `{rem_id}` removed from Admin list.")
     except:
         await update.message.reply_text("❌ Usage: `/removeadmin <user_id>`")
@@ -692,62 +774,82 @@ async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ---------------- QUESTION MANAGEMENT ----------------
 
 async def addquestion(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Improved version with better whitespace handling and validation."""
+    """Starts a background import from a .txt/.csv/.json file or the message text."""
     if not await is_admin(update.effective_user.id): return
     
-    content = ""
-    if update.message.document and update.message.document.file_name.endswith('.txt'):
-        file = await context.bot.get_file(update.message.document.file_id)
-        content = (await file.download_as_bytearray()).decode('utf-8')
-    elif update.message.text:
-        content = update.message.text.replace("/addquestion", "").strip()
+    document = update.message.document
+    if document:
+        fmt = importer.format_for(document.file_name)
+        if not fmt:
+            return await update.message.reply_text("❌ Please provide text or a .txt, .csv or .json file.")
+        status = await update.message.reply_text("⏳ Downloading question file...")
+        run_in_background(context.application, import_questions_file(context.bot, status, document.file_id, fmt))
+        return
 
+    content = update.message.text.replace("/addquestion", "").strip() if update.message.text else ""
     if not content:
-        return await update.message.reply_text("❌ Please provide text or a .txt file.")
-
-    # Split by double newlines, then remove truly empty blocks
-    raw_entries = [e.strip() for e in content.split('\n\n') if e.strip()]
-    added_count = 0
-    skipped_count = 0
+        return await update.message.reply_text("❌ Please provide text or a .txt, .csv or .json file.")
+    status = await update.message.reply_text("⏳ Importing questions...")
+    run_in_background(context.application, import_questions(context.bot, status, io.StringIO(content), 'blocks'))
+
+async def import_questions_file(bot, status, file_id, fmt):
+    """Downloads an uploaded bank to a temp file and streams it into the importer."""
+    fd, path = tempfile.mkstemp(prefix="neetiq-import-")
+    os.close(fd)
+    try:
+        file = await bot.get_file(file_id)
+        await file.download_to_drive(path)
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            await import_questions(bot, status, stream, fmt)
+    except Exception as e:
+        logger.error(f"Question import failed: {e}")
+        await status.edit_text(f"❌ Import failed: {html.escape(str(e))}")
+    finally:
+        os.remove(path)
 
-    with db.get_db() as conn:
-        for entry in raw_entries:
-            # Filter out empty lines within a block (trailing spaces, etc.)
-            lines = [l.strip() for l in entry.split('\n') if l.strip()]
-            
-            if len(lines) >= 7:
+async def import_questions(bot, status, stream, fmt):
+    """
+    Parses the stream incrementally and inserts IMPORT_BATCH_SIZE questions per
+    transaction, editing the status message as it goes.
+    """
+    rows = importer.parse(stream, fmt)
+    added = skipped = 0
+    last_progress = time.monotonic()
+    finished = False
+    try:
+        while not finished:
+            # Parsing reads the file, so it runs off the event loop
+            batch, batch_skipped, finished = await asyncio.to_thread(importer.take, rows, importer.IMPORT_BATCH_SIZE)
+            await db.run(db.insert_questions, batch)
+            added += len(batch)
+            skipped += batch_skipped
+            if not finished and time.monotonic() - last_progress >= importer.IMPORT_PROGRESS_SECONDS:
+                last_progress = time.monotonic()
                 try:
-                    explanation = lines[-1]
-                    # Normalize answer: trim spaces and make uppercase (e.g., 'a ' -> 'A')
-                    correct = str(lines[-2]).strip().upper()
-                    opt_d = lines[-3]
-                    opt_c = lines[-4]
-                    opt_b = lines[-5]
-                    opt_a = lines[-6]
-                    q_text = "\n".join(lines[:-6]) 
-
-                    # Validation: Ensure 'correct' is a valid option identifier
-                    if correct not in ['1', '2', '3', '4', 'A', 'B', 'C', 'D']:
-                        skipped_count += 1
-                        continue
-
-                    conn.execute(
-                        "INSERT INTO questions (question, a, b, c, d, correct, explanation) VALUES (?,?,?,?,?,?,?)",
-                        (q_text, opt_a, opt_b, opt_c, opt_d, correct, explanation)
-                    )
-                    added_count += 1
+                    await status.edit_text(f"⏳ Importing... ✅ {added} added, ⚠️ {skipped} skipped",
+                                           rate_limit_args=sender.JOBS)
                 except Exception:
-                    skipped_count += 1
-            else:
-                skipped_count += 1
+                    pass  # Progress is best effort
+    except asyncio.CancelledError:
+        # The bot is shutting down; tell the admin how far it got, then stop
+        try:
+            await asyncio.wait_for(status.edit_text(
+                f"⚠️ Import interrupted by a restart.\n✅ Added: {added}\n⚠️ Skipped: {skipped}\n"
+                "Re-upload the rest of the file once the bot is back."), 5)
+        except Exception:
+            pass
+        raise
+    except Exception as e:
+        logger.error(f"Question import stopped: {e}")
+        return await status.edit_text(
+            f"❌ Import stopped: {html.escape(str(e))}\n✅ Added before the error: {added}\n⚠️ Skipped: {skipped}")
 
-    await update.message.reply_text(apply_footer(f"📊 *Import Summary:*\n✅ Added: `{added_count}`\n⚠️ Skipped: `{skipped_count}`"))
+    await status.edit_text(apply_footer(f"📊 *Import Summary:*\n✅ Added: `{added}`\n⚠️ Skipped: `{skipped}`"))
 
 async def questions_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Displays total questions currently in the bank."""
     if not await is_admin(update.effective_user.id): return
-    with db.get_db() as conn:
-        total = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+    total = (await db.fetchone("SELECT COUNT(*) FROM questions", fresh=False))[0]
     await update.message.reply_text(f"📘 *Total Questions in Database:* `{total}`")
 
 async def del_all_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -756,7 +858,7 @@ async def del_all_questions(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Correct the name here to match the DB file exactly
-        db.delete_all_questions() 
+        await db.run(db.delete_all_questions) 
         
         await update.message.reply_text("🗑️ Questions deleted!")
     except Exception as e:
@@ -771,8 +873,7 @@ async def addcompliment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         c_type = context.args[0].lower() # 'correct' or 'wrong'
         text = " ".join(context.args[1:])
         if c_type not in ['correct', 'wrong']: raise ValueError
-        with db.get_db() as conn:
-            conn.execute("INSERT INTO compliments (type, text) VALUES (?,?)", (c_type, text))
+        await db.run(db.compliments.add, c_type, text)
         await update.message.reply_text(f"✅ Added {c_type} compliment: \"{text}\"")
     except:
         await update.message.reply_text("❌ *Usage:* `/addcompliment correct Well done {user}!`")
@@ -781,8 +882,7 @@ async def listcompliments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id):
         return
 
-    with db.get_db() as conn:
-        rows = conn.execute("SELECT * FROM compliments").fetchall()
+    rows = db.compliments.list_global()
 
     if not rows:
         await update.message.reply_text("📭 No compliments added yet.")
@@ -792,8 +892,8 @@ async def listcompliments(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     for r in rows:
         text += (
-            f"ID: {r['id']} | Type: {r['type']}\n"
-            f"Text: {r['text']}\n\n"
+            f"ID: {r[0]} | Type: {r[1]}\n"
+            f"Text: {r[2]}\n\n"
         )
 
     chunks = split_message(text)
@@ -805,8 +905,7 @@ async def delcompliment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id): return
     try:
         cid = int(context.args[0])
-        with db.get_db() as conn:
-            conn.execute("DELETE FROM compliments WHERE id = ?", (cid,))
+        await db.run(db.compliments.delete, cid)
         await update.message.reply_text(f"✅ Compliment ID `{cid}` deleted.")
     except:
         await update.message.reply_text("❌ Usage: `/delcompliment <id>`")
@@ -819,7 +918,7 @@ async def delallcompliments(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Call it directly from the imported 'db' module
-        db.delete_all_compliments() 
+        await db.run(db.delete_all_compliments) 
         
         await update.message.reply_text("🗑️ *Compliments Cleared:* The database table is now empty.")
     except Exception as e:
@@ -844,17 +943,16 @@ async def footer_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• `/footer <text>` - Set custom footer text"
         )
 
-    with db.get_db() as conn:
-        if args[0].lower() == 'on':
-            conn.execute("UPDATE settings SET value='1' WHERE key='footer_enabled'")
-            await update.message.reply_text("✅ *Footer is now Enabled.*")
-        elif args[0].lower() == 'off':
-            conn.execute("UPDATE settings SET value='0' WHERE key='footer_enabled'")
-            await update.message.reply_text("❌ *Footer is now Disabled.*")
-        else:
-            new_text = " ".join(args)
-            conn.execute("UPDATE settings SET value=? WHERE key='footer_text'", (new_text,))
-            await update.message.reply_text(f"✅ *Footer text updated to:* `{new_text}`")
+    if args[0].lower() == 'on':
+        await db.run(db.settings.set, 'footer_enabled', '1')
+        await update.message.reply_text("✅ *Footer is now Enabled.*")
+    elif args[0].lower() == 'off':
+        await db.run(db.settings.set, 'footer_enabled', '0')
+        await update.message.reply_text("❌ *Footer is now Disabled.*")
+    else:
+        new_text = " ".join(args)
+        await db.run(db.settings.set, 'footer_text', new_text)
+        await update.message.reply_text(f"✅ *Footer text updated to:* `{new_text}`")
 
 async def autoquiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manages the automatic quiz scheduler."""
@@ -869,38 +967,56 @@ async def autoquiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• `/autoquiz interval <min>` - Set time interval (minutes)"
         )
 
-    with db.get_db() as conn:
-        if args[0].lower() == 'on':
-            conn.execute("UPDATE settings SET value='1' WHERE key='autoquiz_enabled'")
-            await update.message.reply_text("✅ *Auto Quiz mode is now ON.*")
-        elif args[0].lower() == 'off':
-            conn.execute("UPDATE settings SET value='0' WHERE key='autoquiz_enabled'")
-            await update.message.reply_text("❌ *Auto Quiz mode is now OFF.*")
-        elif args[0].lower() == 'interval' and len(args) > 1:
-            try:
-                minutes = int(args[1])
-                conn.execute("UPDATE settings SET value=? WHERE key='autoquiz_interval'", (str(minutes),))
-                await update.message.reply_text(f"✅ *Quiz interval set to {minutes} minutes.*")
-            except ValueError:
-                await update.message.reply_text("❌ Please provide a valid number for minutes.")
+    if args[0].lower() == 'on':
+        await db.run(db.settings.set, 'autoquiz_enabled', '1')
+        await update.message.reply_text("✅ *Auto Quiz mode is now ON.*")
+    elif args[0].lower() == 'off':
+        await db.run(db.settings.set, 'autoquiz_enabled', '0')
+        await update.message.reply_text("❌ *Auto Quiz mode is now OFF.*")
+    elif args[0].lower() == 'interval' and len(args) > 1:
+        try:
+            minutes = int(args[1])
+            await db.run(db.settings.set, 'autoquiz_interval', minutes)
+            await update.message.reply_text(f"✅ *Quiz interval set to {minutes} minutes.*")
+        except ValueError:
+            await update.message.reply_text("❌ Please provide a valid number for minutes.")
+
+AUTOQUIZ_CONCURRENCY = int(os.environ.get("AUTOQUIZ_CONCURRENCY", "30"))  # polls in flight
+# Per-round figures of the last auto quiz runs, newest last
+autoquiz_rounds = deque(maxlen=20)
+
+def autoquiz_stats():
+    """The latest round's figures plus averages over the rounds kept in autoquiz_rounds."""
+    if not autoquiz_rounds:
+        return {}
+    rounds = list(autoquiz_rounds)
+    return {
+        **rounds[-1],
+        'avg_send_seconds': sum(r['send_seconds'] for r in rounds) / len(rounds),
+        'avg_failed': sum(r['failed'] for r in rounds) / len(rounds),
+        'rounds': len(rounds),
+    }
+
+def is_dead_chat_error(e) -> bool:
+    """True when an API error means the bot can never post in that chat again."""
+    return isinstance(e, Forbidden) or (isinstance(e, BadRequest) and "chat not found" in str(e).lower())
 
 async def auto_quiz_job(context: ContextTypes.DEFAULT_TYPE):
     """Picks ONE question and sends it to ALL groups simultaneously with HTML formatting."""
-    with db.get_db() as conn:
-        # 1. Check if auto-quiz is enabled
-        setting = conn.execute("SELECT value FROM settings WHERE key='autoquiz_enabled'").fetchone()
-        if not setting or setting[0] == '0': 
-            return
-        
-        # 2. Pick a random question
-        # Fetching by index to ensure compatibility: id:0, question:1, a:2, b:3, c:4, d:5, correct:6, explanation:7
-        q = conn.execute("SELECT id, question, a, b, c, d, correct, explanation FROM questions ORDER BY RANDOM() LIMIT 1").fetchone()
-        
-        if not q:
-            return 
+    # 1. Check if auto-quiz is enabled
+    if not db.settings.autoquiz_enabled: 
+        return
+    
+    # 2. Claim a random question (removed from the pool right away)
+    # Fetching by index to ensure compatibility: id:0, question:1, a:2, b:3, c:4, d:5, correct:6, explanation:7
+    q = await db.run(db.question_pool.pop)
+    
+    if not q:
+        return 
 
-        # 3. Get all active groups
-        chats = conn.execute("SELECT chat_id FROM chats WHERE type != 'private'").fetchall()
+    # 3. Get all active groups (minus the ones that failed for good)
+    started = time.monotonic()
+    chat_ids = await db.run(db.get_quiz_groups)
 
     # Prep Poll Data
     options = [str(q[2]), str(q[3]), str(q[4]), str(q[5])]
@@ -911,113 +1027,185 @@ async def auto_quiz_job(context: ContextTypes.DEFAULT_TYPE):
     question_text = f"🧠 <b>NEET MCQ (Global Quiz)</b>\n{divider}\n\n{q[1]}"
     explanation_text = f"📖 <b>Explanation:</b>\n{q[7]}"
 
-    # Send to all groups
-    for c in chats:
-        try:
-            msg = await context.bot.send_poll(
-                chat_id=c[0],
-                question=question_text,
-                options=options,
-                type=Poll.QUIZ,
-                correct_option_id=c_idx,
-                explanation=explanation_text,
-                explanation_parse_mode=ParseMode.HTML,
-                is_anonymous=False
-            )
-            
-            # Register active poll for scoring
-            with db.get_db() as conn:
-                conn.execute("INSERT INTO active_polls (poll_id, chat_id, correct_option_id) VALUES (?,?,?)", 
-                             (msg.poll.id, c[0], c_idx))
-            
-            await asyncio.sleep(0.2) 
-        except Exception:
-            continue
+    # 4. Send to all groups concurrently; the send scheduler keeps us inside Telegram's limits
+    semaphore = asyncio.Semaphore(AUTOQUIZ_CONCURRENCY)
+    polls, dead, failed = [], [], 0
+
+    async def deliver(chat_id):
+        nonlocal failed
+        async with semaphore:
+            try:
+                msg = await context.bot.send_poll(
+                    chat_id=chat_id,
+                    question=question_text,
+                    options=options,
+                    type=Poll.QUIZ,
+                    correct_option_id=c_idx,
+                    explanation=explanation_text,
+                    explanation_parse_mode=ParseMode.HTML,
+                    is_anonymous=False,
+                    rate_limit_args=sender.JOBS
+                )
+                polls.append((msg.poll.id, chat_id, c_idx))
+            except Exception as e:
+                failed += 1
+                if is_dead_chat_error(e):
+                    dead.append(chat_id)
+
+    await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
+    sent_at = time.monotonic()
+
+    # 5. Register every poll for scoring in one bulk insert, then retire dead groups
+    try:
+        await db.run(db.polls.register_many, polls)
+        await db.run(db.mark_quiz_failed, dead)
+    except Exception as e:
+        logger.error(f"Auto quiz registration failed: {e}")
+
+    round_stats = {
+        'groups': len(chat_ids), 'sent': len(polls), 'failed': failed, 'dead': len(dead),
+        'send_seconds': round(sent_at - started, 2), 'total_seconds': round(time.monotonic() - started, 2),
+    }
+    autoquiz_rounds.append(round_stats)
+    metrics.record_job('auto_quiz', started, sent=len(polls), failed=failed)
+    logger.info(f"Auto quiz round: {round_stats}")
+
+async def flush_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Writes buffered poll-answer stats to the database in bulk."""
+    try:
+        await db.run(db.flush_stats)
+    except Exception as e:
+        # The buffer keeps the failed batch, the next run retries it
+        logger.error(f"Stats flush failed: {e}")
+
+async def refresh_settings_job(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic safety reload of the settings cache."""
+    try:
+        await db.run(db.settings.load)
+    except Exception as e:
+        logger.error(f"Settings refresh failed: {e}")
+
+async def purge_polls_job(context: ContextTypes.DEFAULT_TYPE):
+    """Drops expired quiz polls from the registry and the active_polls table."""
+    try:
+        deleted = await db.run(db.polls.purge_expired)
+        if deleted:
+            logger.info(f"Purged {deleted} expired active_polls rows")
+    except Exception as e:
+        logger.error(f"Poll purge failed: {e}")
+
+async def compact_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Rolls old daily_stats rows into weekly/monthly totals and drops them."""
+    started = time.monotonic()
+    try:
+        compacted = await db.run(db.compact_daily_stats)
+        logger.info(f"Compacted {compacted} daily_stats rows in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        logger.error(f"daily_stats compaction failed: {e}")
 
-    # 4. Remove question from pool after successful broadcast
-    with db.get_db() as conn:
-        conn.execute("DELETE FROM questions WHERE id = ?", (q[0],))
+async def sync_replica_job(context: ContextTypes.DEFAULT_TYPE):
+    """Pulls recent writes into the local read replica."""
+    try:
+        await db.run(db.replica.sync)
+    except Exception as e:
+        logger.error(f"Replica sync failed (lag {db.replica.lag_seconds}s): {e}")
+
+async def refresh_admins_job(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic reload of the admin cache."""
+    try:
+        await db.run(db.admins.load)
+    except Exception as e:
+        logger.error(f"Admin cache refresh failed: {e}")
+
+NIGHTLY_CONCURRENCY = int(os.environ.get("NIGHTLY_CONCURRENCY", "30"))  # messages in flight
+
+def render_leaderboard_rows(rows, empty_text):
+    """Plain-text ranking lines for the nightly summary."""
+    if not rows:
+        return f"<i>{empty_text}</i>\n"
+    # Using html.escape to prevent formatting errors from user names
+    return "".join(f"{get_rank_icon(i)} {html.escape(str(r[0]))} - {r[3]:,} pts\n" for i, r in enumerate(rows, 1))
 
 async def nightly_leaderboard_job(context: ContextTypes.DEFAULT_TYPE):
     """Sends a daily summary with plain-text names and bold headers."""
-    
-    # 1. Generate Global List (Plain Text)
-    # Using html.escape to prevent formatting errors from user names
-    global_rows = db.get_leaderboard_data(limit=10)
-    global_list = ""
-    if not global_rows:
-        global_list = "<i>No global data recorded today.</i>\n"
-    else:
-        for i, r in enumerate(global_rows, 1):
-            badge = get_rank_icon(i) # Your icon function
-            name = html.escape(str(r[0]))
-            # Points formatted with commas for readability
-            global_list += f"{badge} {name} - {r[3]:,} pts\n"
+    started = time.monotonic()
 
-    # 2. Get Group List
-    with db.get_db() as conn:
-        chats = conn.execute("SELECT chat_id, title FROM chats WHERE type != 'private'").fetchall()
+    # 1. Global top 10, the group list and every group's top 10 in one query batch
+    global_rows, chats, group_rows = await db.run(db.get_nightly_leaderboards, limit=10, fresh=False)
+    global_list = render_leaderboard_rows(global_rows, "No global data recorded today.")
+    db_seconds = time.monotonic() - started
 
-    # 3. Process each group
-    for c in chats:
-        chat_id = c[0]
+    # 2. Render every group's message in memory
+    divider = "<b>━━━━━━━━━━━━━━━━━━━━</b>"
+    messages = []
+    for chat_id, raw_title in chats:
         # Ensure the group title is safe for HTML
-        raw_title = c[1] if c[1] else "This Group"
-        safe_title = html.escape(raw_title)
-        
-        try:
-            group_rows = db.get_leaderboard_data(chat_id=chat_id, limit=10)
-            group_list = ""
+        safe_title = html.escape(raw_title if raw_title else "This Group")
+        group_list = render_leaderboard_rows(group_rows.get(chat_id), "No participants in this group yet.")
+        final_message = (
+            "🌙 <b>DAILY LEADERBOARD</b>\n"
+            f"{divider}\n"
+            "🌍 <b>Global Top 10</b>\n"
+            f"{global_list}"
+            f"{divider}\n"
+            f"👥 <b>{safe_title.upper()} Top 10</b>\n"
+            f"{group_list}"
+            f"{divider}\n"
+            "Great effort today, champs! 🚀\nKeep the momentum going!"
+        )
+        # apply_footer adds your custom footer text
+        messages.append((chat_id, apply_footer(final_message)))
 
-            if not group_rows:
-                group_list = "<i>No participants in this group yet.</i>\n"
-            else:
-                for i, r in enumerate(group_rows, 1):
-                    # FIX: Changed get_badge to get_rank_icon to match your code
-                    badge = get_rank_icon(i) 
-                    name = html.escape(str(r[0]))
-                    group_list += f"{badge} {name} - {r[3]:,} pts\n"
-
-            divider = "<b>━━━━━━━━━━━━━━━━━━━━</b>"
-            final_message = (
-                "🌙 <b>DAILY LEADERBOARD</b>\n"
-                f"{divider}\n"
-                "🌍 <b>Global Top 10</b>\n"
-                f"{global_list}"
-                f"{divider}\n"
-                f"👥 <b>{safe_title.upper()} Top 10</b>\n"
-                f"{group_list}"
-                f"{divider}\n"
-                "Great effort today, champs! 🚀\nKeep the momentum going!"
-            )
+    # 3. Send concurrently; the send scheduler paces the JOBS lane
+    semaphore = asyncio.Semaphore(NIGHTLY_CONCURRENCY)
+    dead, sent = [], 0
 
-            # apply_footer adds your custom footer text
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=apply_footer(final_message),
-                parse_mode="HTML",
-                disable_web_page_preview=True
-            )
-            
-            # Anti-flood delay to prevent Telegram from blocking the bot
-            await asyncio.sleep(0.5)
-            
-        except Exception as e:
-            # Logs the error but keeps the loop running for other groups
-            print(f"⚠️ Error sending leaderboard to {chat_id}: {e}")
-            continue
+    async def deliver(chat_id, text):
+        nonlocal sent
+        async with semaphore:
+            try:
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode="HTML",
+                    disable_web_page_preview=True,
+                    rate_limit_args=sender.JOBS
+                )
+                sent += 1
+            except Exception as e:
+                # Logs the error but keeps going for other groups
+                print(f"⚠️ Error sending leaderboard to {chat_id}: {e}")
+                if is_dead_chat_error(e):
+                    dead.append(chat_id)
+
+    await asyncio.gather(*(deliver(chat_id, text) for chat_id, text in messages))
+    try:
+        await db.run(db.mark_quiz_failed, dead)
+    except Exception as e:
+        logger.error(f"Could not retire dead groups: {e}")
+
+    metrics.record_job('nightly_leaderboard', started, sent=sent, failed=len(messages) - sent)
+    logger.info(f"Nightly leaderboard: sent {sent}/{len(messages)} groups, "
+                f"db {db_seconds:.2f}s, total {time.monotonic() - started:.2f}s")
 
 
 async def bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Provides a high-level overview of the bot's reach and data."""
     if not await is_admin(update.effective_user.id): return
     
-    with db.get_db() as conn:
-        total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-        total_chats = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
-        total_questions = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
-        total_attempts = conn.execute("SELECT SUM(attempted) FROM stats").fetchone()[0] or 0
-        total_admins = conn.execute("SELECT COUNT(*) FROM admins").fetchone()[0] + 1 # +1 for Owner
+    results = await db.batch([
+        ("SELECT COUNT(*) FROM users", ()),
+        ("SELECT COUNT(*) FROM chats", ()),
+        ("SELECT COUNT(*) FROM questions", ()),
+        ("SELECT SUM(attempted) FROM stats", ()),
+        ("SELECT COUNT(*) FROM admins", ()),
+    ], fresh=False)
+    total_users = results[0][0][0]
+    total_chats = results[1][0][0]
+    total_questions = results[2][0][0]
+    total_attempts = results[3][0][0] or 0
+    total_admins = results[4][0][0] + 1 # +1 for Owner
+    join_stats = membership_cache.stats()
 	
     stats_text = (
         "🤖 *NEETIQ Master Bot Statistics*\n\n"
@@ -1026,7 +1214,10 @@ async def bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👮 *Total Admins:* `{total_admins}`\n\n"
         "📊 *Database Growth*\n"
         f"❓ *Total Questions:* `{total_questions}`\n"
-        f"📝 *Total Global Attempts:* `{total_attempts}`\n"
+        f"📝 *Total Global Attempts:* `{total_attempts}`\n\n"
+        "🔐 *Force-Join Cache*\n"
+        f"🎯 *Hit Rate:* `{join_stats['hit_rate']:.0%}`\n"
+        f"📉 *API Calls Saved:* `{join_stats['api_calls_saved']}`\n"
     )
     
     await update.message.reply_text(apply_footer(stats_text))
@@ -1052,8 +1243,7 @@ async def toggle_compliments(update: Update, context: ContextTypes.DEFAULT_TYPE)
     status = 1 if status_input == 'on' else 0
     chat_id = update.effective_chat.id
 
-    with db.get_db() as conn:
-        conn.execute("INSERT OR REPLACE INTO group_settings (chat_id, compliments_enabled) VALUES (?, ?)", (chat_id, status))
+    await db.run(db.settings.set_group_compliments, chat_id, status)
     
     await update.message.reply_text(f"✅ Compliments are now {'ON' if status else 'OFF'}")
 
@@ -1072,10 +1262,7 @@ async def set_group_compliment(update: Update, context: ContextTypes.DEFAULT_TYP
     if c_type not in ['correct', 'wrong']:
         return await update.message.reply_text("❌ Type must be 'correct' or 'wrong'.")
 
-    with db.get_db() as conn:
-        # Delete old custom ones for this type in this group first to prevent spam
-        conn.execute("DELETE FROM group_compliments WHERE chat_id = ? AND type = ?", (chat_id, c_type))
-        conn.execute("INSERT INTO group_compliments VALUES (?, ?, ?)", (chat_id, c_type, c_text))
+    await db.run(db.compliments.set_group, chat_id, c_type, c_text)
     
     await update.message.reply_text(f"✅ Custom {c_type} message saved!")
 
@@ -1083,9 +1270,16 @@ async def set_group_compliment(update: Update, context: ContextTypes.DEFAULT_TYP
 # REPLACE with your actual source group ID
 SOURCE_GROUP_ID = -1003729584653 
 
+MIRROR_CONCURRENCY = int(os.environ.get("MIRROR_CONCURRENCY", "30"))  # copies in flight
+# Album parts arrive as separate updates within a few hundred ms of each other
+MIRROR_ALBUM_WAIT_SECONDS = float(os.environ.get("MIRROR_ALBUM_WAIT_SECONDS", "1.5"))
+# media_group_id -> message ids collected so far
+pending_albums = {}
+
 async def mirror_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Enhanced Mirroring: Supports Photos, PDFs, Stickers, Polls, and Formatted Text.
+    Albums are collected first and copied to each target with one copy_messages call.
     """
     # 1. Security Check
     if update.effective_chat.id != SOURCE_GROUP_ID:
@@ -1095,59 +1289,88 @@ async def mirror_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text and update.message.text.startswith('/'):
         return
 
-    # 3. Get targets from DB
-    with db.get_db() as conn:
-        user_rows = conn.execute("SELECT user_id FROM users").fetchall()
-        group_rows = conn.execute("SELECT chat_id FROM chats WHERE chat_id != ?", (SOURCE_GROUP_ID,)).fetchall()
-    
-    # Track counts for the final message
-    user_ids = [row[0] for row in user_rows]
-    group_ids = [row[0] for row in group_rows]
-    all_targets = set(user_ids + group_ids)
+    message_id = update.message.message_id
+    album_id = update.message.media_group_id
+    if not album_id:
+        run_in_background(context.application, mirror_to_all(context.bot, [message_id]))
+        return
 
-    print(f"📡 Mirroring content to {len(all_targets)} destinations...")
+    # 3. Buffer album parts; the first part schedules the send for the whole album
+    if album_id in pending_albums:
+        pending_albums[album_id].append(message_id)
+        return
+    pending_albums[album_id] = [message_id]
 
+    async def flush_album():
+        await asyncio.sleep(MIRROR_ALBUM_WAIT_SECONDS)
+        await mirror_to_all(context.bot, sorted(pending_albums.pop(album_id)))
+
+    run_in_background(context.application, flush_album())
+
+async def mirror_to_all(bot, message_ids):
+    """Copies source messages to every user and group, then prunes unreachable chats in one batch."""
+    # Get targets from DB
+    all_targets = await db.run(db.get_mirror_targets, SOURCE_GROUP_ID)
+
+    print(f"📡 Mirroring {len(message_ids)} message(s) to {len(all_targets)} destinations...")
+    started = time.monotonic()
+
+    semaphore = asyncio.Semaphore(MIRROR_CONCURRENCY)
     user_success = 0
     group_success = 0
-    removed = 0
+    dead = []
+
+    async def deliver(target_id):
+        nonlocal user_success, group_success
+        async with semaphore:
+            try:
+                if len(message_ids) == 1:
+                    # copy_message handles PDFs, Images, and Inline buttons automatically
+                    await bot.copy_message(chat_id=target_id, from_chat_id=SOURCE_GROUP_ID,
+                                           message_id=message_ids[0], rate_limit_args=sender.BULK)
+                else:
+                    # One call per target for the whole album, which arrives grouped
+                    await bot.copy_messages(chat_id=target_id, from_chat_id=SOURCE_GROUP_ID,
+                                            message_ids=message_ids, rate_limit_args=sender.BULK)
+            except Exception as e:
+                if is_dead_chat_error(e):
+                    dead.append(target_id)
+                else:
+                    print(f"❌ Mirror Error for {target_id}: {e}")
+                return
 
-    for target_id in all_targets:
-        try:
-            # copy_message handles PDFs, Images, and Inline buttons automatically
-            await context.bot.copy_message(
-                chat_id=target_id,
-                from_chat_id=SOURCE_GROUP_ID,
-                message_id=update.message.message_id
-            )
-            
             # Count success based on ID type (Groups usually have negative IDs)
             if str(target_id).startswith('-'):
                 group_success += 1
             else:
                 user_success += 1
-                
-            await asyncio.sleep(0.05) 
-
-        except (Forbidden, BadRequest) as e:
-            error_msg = str(e)
-            if "Forbidden" in error_msg or "Chat not found" in error_msg:
-                with db.get_db() as conn:
-                    conn.execute("DELETE FROM users WHERE user_id = ?", (target_id,))
-                    conn.execute("DELETE FROM chats WHERE chat_id = ?", (target_id,))
-                removed += 1
-        except Exception as e:
-            print(f"❌ Mirror Error for {target_id}: {e}")
+
+    await asyncio.gather(*(deliver(target_id) for target_id in all_targets))
+    metrics.record_job('mirror', started, sent=user_success + group_success,
+                       failed=len(all_targets) - user_success - group_success)
+
+    # Unreachable users and chats are removed together at the end
+    try:
+        await db.run(db.prune_chats, dead)
+    except Exception as e:
+        logger.error(f"Mirror prune failed: {e}")
 
     # 4. Send the Congratulations Summary to YOU or the Master Group
     summary = (
         "Congratulations 🎉\n"
         f"Sent to : {group_success} grps and {user_success} users"
     )
-    await context.bot.send_message(chat_id=SOURCE_GROUP_ID, text=summary)
+    await bot.send_message(chat_id=SOURCE_GROUP_ID, text=summary, rate_limit_args=sender.JOBS)
 
 import os
 from threading import Thread
-from flask import Flask
+from flask import Flask, Response
+
+metrics.gauge('neetiq_pending_albums', 'Mirrored albums still collecting parts', lambda: {(): len(pending_albums)})
+metrics.stats_gauge('neetiq_autoquiz_round', 'Last auto quiz round (groups, sent, failed, dead, timings) and recent averages',
+                    autoquiz_stats)
+metrics.stats_gauge('neetiq_force_join_cache', 'Force-join membership cache lookups and Telegram calls',
+                    membership_cache.stats)
 
 # --- KEEP-ALIVE SERVER FOR RENDER ---
 flask_app = Flask('')
@@ -1156,6 +1379,10 @@ flask_app = Flask('')
 def home():
     return "Bot is running!"
 
+@flask_app.route('/metrics')
+def metrics_route():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 def run_flask():
     # Render provides PORT environment variable automatically
     port = int(os.environ.get("PORT", 8080))
@@ -1175,14 +1402,108 @@ from zoneinfo import ZoneInfo
 from datetime import time as dt_time
 from telegram.constants import ParseMode
 
+# Signals that stop the bot cleanly (Render sends SIGTERM on every deploy/restart)
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+# How long cancelled background tasks get to wind down before the application stops
+SHUTDOWN_TASK_TIMEOUT = 10
+
+def install_stop_handlers(callback):
+    loop = asyncio.get_running_loop()
+    for sig in STOP_SIGNALS:
+        loop.add_signal_handler(sig, callback)
+
+async def prepare_shutdown(application):
+    """
+    First step of every stop, before Application.stop(), which waits for running jobs
+    and tasks: flush the buffered stats right away, then cancel the background work so
+    the rest of the shutdown finishes well before the platform's SIGKILL.
+    """
+    await on_shutdown(application)
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=SHUTDOWN_TASK_TIMEOUT)
+
+stopping = []
+
+async def stop_polling(application):
+    await prepare_shutdown(application)
+    application.stop_running()
+
+def request_stop(application):
+    # A second signal during the flush changes nothing; keep a reference to the task
+    if not stopping:
+        stopping.append(asyncio.ensure_future(stop_polling(application)))
+
+async def on_startup(application):
+    await resume_broadcasts(application)
+    if not webserver.WEBHOOK_MODE:
+        # Our own handler instead of run_polling's, so the flush comes before stop()
+        install_stop_handlers(lambda: request_stop(application))
+
+async def run_webhook(application):
+    """
+    Webhook mode: Telegram pushes updates to our in-loop HTTP server, which also
+    answers the health route (replaces long polling and the Flask thread).
+    """
+    server = webserver.WebhookServer(application)
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            if webserver.WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    url=webserver.WEBHOOK_URL + webserver.WEBHOOK_PATH,
+                    secret_token=webserver.WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+            await application.start()
+            await server.start()
+            # Serve until SIGTERM (sent by Render on every deploy/restart) or Ctrl+C
+            stopped = asyncio.Event()
+            install_stop_handlers(stopped.set)
+            try:
+                await stopped.wait()
+            finally:
+                await server.stop()
+                await prepare_shutdown(application)
+                await application.stop()
+    finally:
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+async def on_shutdown(application):
+    """
+    Flushes buffered stats so no answers are lost on restart. Runs in prepare_shutdown
+    and again as post_shutdown, for answers handled while the application stopped.
+    """
+    try:
+        await db.run(db.flush_stats)
+    except Exception as e:
+        print(f"⚠️ Final stats flush failed: {e}")
+
 # --- MAIN EXECUTION ---
 if __name__ == '__main__':
-    # 1. Initialize Database
+    # 1. Initialize Database and warm the in-memory caches
     db.init_db()
+    db.settings.load()
+    db.admins.load()
+    db.compliments.load()
+    db.load_ranks()
+    if db.replica.enabled:
+        try:
+            db.replica.open()
+            print(f"📚 Local read replica ready at {db.REPLICA_PATH}")
+        except Exception as e:
+            # Stale-tolerant reads simply keep going to the primary
+            print(f"⚠️ Read replica unavailable: {e}")
     
-    # 2. Start the Keep-Alive Web Server
-    print("🌐 Starting Keep-Alive server...")
-    keep_alive()
+    # 2. Start the Keep-Alive Web Server (webhook mode serves health pings itself)
+    if not webserver.WEBHOOK_MODE:
+        print("🌐 Starting Keep-Alive server...")
+        keep_alive()
 
     # 3. Define Timezone for Kolkata (Modern way)
     ist_timezone = ZoneInfo('Asia/Kolkata')
@@ -1194,6 +1515,11 @@ if __name__ == '__main__':
                 ApplicationBuilder()
                 .token(os.environ.get("BOT_TOKEN")) 
                 .defaults(Defaults(parse_mode=ParseMode.HTML, tzinfo=ist_timezone)) 
+                .post_init(on_startup)
+                .post_shutdown(on_shutdown)
+                .concurrent_updates(CONCURRENT_UPDATES)
+                # Every outgoing API call is paced and prioritised here (see sender.py)
+                .rate_limiter(sender.send_scheduler)
                 .build()
             )
 
@@ -1203,53 +1529,48 @@ if __name__ == '__main__':
             application.add_error_handler(error_handler)
 
             # 1. Callback Query Handlers
-            application.add_handler(CallbackQueryHandler(handle_broadcast_callback, pattern="^bc_"))
-            application.add_handler(CallbackQueryHandler(mystats, pattern="^check_join$"))
+            application.add_handler(CallbackQueryHandler(metrics.timed("callback:broadcast", handle_broadcast_callback), pattern="^bc_"))
+            application.add_handler(CallbackQueryHandler(metrics.timed("callback:check_join", mystats), pattern="^check_join$"))
 
             # 2. Commands
-            application.add_handler(CommandHandler("start", start))
-            application.add_handler(CommandHandler("help", help_command))
-            application.add_handler(CommandHandler("randomquiz", send_random_quiz))
-            application.add_handler(CommandHandler("myscore", myscore))
-            application.add_handler(CommandHandler("mystats", mystats))
-            application.add_handler(CommandHandler("leaderboard", leaderboard))
-            application.add_handler(CommandHandler("botstats", bot_stats))
-            application.add_handler(CommandHandler("setcomp", set_group_compliment))
-            application.add_handler(CommandHandler("comp_toggle", toggle_compliments))
-            application.add_handler(CommandHandler("groupleaderboard", groupleaderboard))
-            application.add_handler(CommandHandler("addadmin", add_admin))
-            application.add_handler(CommandHandler("removeadmin", remove_admin))
-            application.add_handler(CommandHandler("adminlist", adminlist))
-            application.add_handler(CommandHandler("addquestion", addquestion))
-            application.add_handler(CommandHandler("questions", questions_stats))
-            application.add_handler(CommandHandler("broadcast", broadcast))
-            application.add_handler(CommandHandler("addcompliment", addcompliment))
-            application.add_handler(CommandHandler("listcompliments", listcompliments))
-            application.add_handler(CommandHandler("delcompliment", delcompliment))
-            application.add_handler(CommandHandler("footer", footer_cmd))
-            application.add_handler(CommandHandler("autoquiz", autoquiz))
-            application.add_handler(CommandHandler("delallquestions", del_all_questions))
-            application.add_handler(CommandHandler("delallcompliments", delallcompliments))
+            application.add_handler(CommandHandler("start", metrics.timed("/start", start)))
+            application.add_handler(CommandHandler("help", metrics.timed("/help", help_command)))
+            application.add_handler(CommandHandler("randomquiz", metrics.timed("/randomquiz", send_random_quiz)))
+            application.add_handler(CommandHandler("myscore", metrics.timed("/myscore", myscore)))
+            application.add_handler(CommandHandler("mystats", metrics.timed("/mystats", mystats)))
+            application.add_handler(CommandHandler("leaderboard", metrics.timed("/leaderboard", leaderboard)))
+            application.add_handler(CommandHandler("botstats", metrics.timed("/botstats", bot_stats)))
+            application.add_handler(CommandHandler("setcomp", metrics.timed("/setcomp", set_group_compliment)))
+            application.add_handler(CommandHandler("comp_toggle", metrics.timed("/comp_toggle", toggle_compliments)))
+            application.add_handler(CommandHandler("groupleaderboard", metrics.timed("/groupleaderboard", groupleaderboard)))
+            application.add_handler(CommandHandler("addadmin", metrics.timed("/addadmin", add_admin)))
+            application.add_handler(CommandHandler("removeadmin", metrics.timed("/removeadmin", remove_admin)))
+            application.add_handler(CommandHandler("adminlist", metrics.timed("/adminlist", adminlist)))
+            application.add_handler(CommandHandler("addquestion", metrics.timed("/addquestion", addquestion)))
+            application.add_handler(CommandHandler("questions", metrics.timed("/questions", questions_stats)))
+            application.add_handler(CommandHandler("broadcast", metrics.timed("/broadcast", broadcast)))
+            application.add_handler(CommandHandler("addcompliment", metrics.timed("/addcompliment", addcompliment)))
+            application.add_handler(CommandHandler("listcompliments", metrics.timed("/listcompliments", listcompliments)))
+            application.add_handler(CommandHandler("delcompliment", metrics.timed("/delcompliment", delcompliment)))
+            application.add_handler(CommandHandler("footer", metrics.timed("/footer", footer_cmd)))
+            application.add_handler(CommandHandler("autoquiz", metrics.timed("/autoquiz", autoquiz)))
+            application.add_handler(CommandHandler("delallquestions", metrics.timed("/delallquestions", del_all_questions)))
+            application.add_handler(CommandHandler("delallcompliments", metrics.timed("/delallcompliments", delallcompliments)))
 
             # 3. Mirroring & Special Handlers
             application.add_handler(MessageHandler(
                 filters.Chat(SOURCE_GROUP_ID) & 
                 (~filters.COMMAND) & 
-                (filters.TEXT | filters.PHOTO | filters.Document.ALL | filters.POLL), 
-                mirror_messages
+                (filters.TEXT | filters.PHOTO | filters.VIDEO | filters.AUDIO | filters.Document.ALL | filters.POLL), 
+                metrics.timed("mirror", mirror_messages)
             ))
-            application.add_handler(MessageHandler(filters.Document.ALL & ~filters.Chat(SOURCE_GROUP_ID), addquestion))
-            application.add_handler(PollAnswerHandler(handle_poll_answer))
+            application.add_handler(MessageHandler(filters.Document.ALL & ~filters.Chat(SOURCE_GROUP_ID), metrics.timed("document", addquestion)))
+            application.add_handler(PollAnswerHandler(metrics.timed("poll_answer", handle_poll_answer)))
 
             # --- JOB QUEUE SETUP ---
             jq = application.job_queue
 
-            try:
-                with db.get_db() as conn:
-                    row = conn.execute("SELECT value FROM settings WHERE key='autoquiz_interval'").fetchone()
-                    interval_min = int(row[0]) if row else 30
-            except Exception:
-                interval_min = 30 
+            interval_min = db.settings.autoquiz_interval
 
             jq.run_repeating(
                 auto_quiz_job, 
@@ -1261,6 +1582,22 @@ if __name__ == '__main__':
                 }
             )
 
+            # Settings cache safety refresh
+            jq.run_repeating(refresh_settings_job, interval=db.SETTINGS_TTL_SECONDS, first=db.SETTINGS_TTL_SECONDS)
+
+            # Admin cache refresh
+            jq.run_repeating(refresh_admins_job, interval=db.ADMINS_REFRESH_SECONDS, first=db.ADMINS_REFRESH_SECONDS)
+
+            # Expired poll cleanup
+            jq.run_repeating(purge_polls_job, interval=db.ACTIVE_POLL_PURGE_SECONDS, first=60)
+
+            # Local read replica sync
+            if db.replica.enabled:
+                jq.run_repeating(sync_replica_job, interval=db.REPLICA_SYNC_SECONDS, first=db.REPLICA_SYNC_SECONDS)
+
+            # Write-behind flush of poll-answer stats
+            jq.run_repeating(flush_stats_job, interval=db.STATS_FLUSH_SECONDS, first=db.STATS_FLUSH_SECONDS)
+
             # Nightly Leaderboard at 21:00 IST
             jq.run_daily(
                 nightly_leaderboard_job,
@@ -1272,11 +1609,28 @@ if __name__ == '__main__':
                 }
             )
 
+            # daily_stats retention: roll up and delete old rows at 03:30 IST
+            jq.run_daily(
+                compact_stats_job,
+                time=dt_time(hour=3, minute=30, tzinfo=ist_timezone),
+                name="compact_daily_stats",
+                job_kwargs={
+                    'misfire_grace_time': 3600,
+                    'coalesce': True
+                }
+            )
+
             print("🚀 NEETIQBot is fully secured and Online!")
             
-            # Polling: drop_pending_updates=True clears old messages on restart
-            # stop_signals=None prevents external signals from killing the process abruptly
-            application.run_polling(drop_pending_updates=True, stop_signals=None)
+            if webserver.WEBHOOK_MODE:
+                asyncio.run(run_webhook(application))
+            else:
+                # Polling: drop_pending_updates=True clears old messages on restart
+                # Stop signals are handled by on_startup's handler (flush first, then stop)
+                application.run_polling(drop_pending_updates=True, stop_signals=None)
+            # Returning normally means we were asked to stop: don't auto-restart
+            print("👋 Bot stopped.")
+            break
 
         except Exception as e:
             print(f"⚠️ Critical Error: {e}")
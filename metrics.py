@@ -0,0 +1,140 @@
+import time
+import bisect
+import functools
+import threading
+
+# --- METRICS REGISTRY ---
+# Prometheus text exposition, served on /metrics by the keep-alive/webhook server.
+# Updates come from the event loop and from the DB worker threads, so every
+# metric guards its samples with a lock.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+_metrics = []   # Counter/Histogram instances, in registration order
+_gauges = {}    # name -> (help, labelnames, func returning {label values tuple: number})
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in sorted(values.items(), key=str)]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][slot] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = {k: ([*v[0]], v[1], v[2]) for k, v in self._values.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(values.items(), key=str):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, '+Inf'), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def gauge(name, help, func, labelnames=()):
+    """
+    Registers a gauge read at scrape time: func() returns {label values tuple: number}.
+    Registering the same name again replaces the previous reader.
+    """
+    _gauges[name] = (help, tuple(labelnames), func)
+
+def stats_gauge(name, help, stats, label='stat'):
+    """Registers a gauge that exports every numeric field of a stats() dict as one series per field."""
+    def read():
+        return {(key,): int(value) if isinstance(value, bool) else value
+                for key, value in stats().items() if isinstance(value, (int, float))}
+    gauge(name, help, read, [label])
+
+def render():
+    """All metrics in Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for name, (help, labelnames, func) in list(_gauges.items()):
+        try:
+            values = func()
+        except Exception:
+            continue  # A collector racing a writer just skips this scrape
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_labels(labelnames, k)} {v}" for k, v in values.items()]
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- APPLICATION METRICS ----------------
+
+handler_seconds = Histogram('neetiq_handler_seconds', 'Handler latency per command and callback', ['handler'])
+handler_errors = Counter('neetiq_handler_errors_total', 'Handlers that raised', ['handler'])
+db_seconds = Histogram('neetiq_db_roundtrip_seconds', 'Database round-trip latency per query site', ['site', 'target'])
+db_errors = Counter('neetiq_db_errors_total', 'Failed database round trips per query site', ['site', 'target'])
+api_seconds = Histogram('neetiq_telegram_api_seconds', 'Telegram Bot API call latency', ['endpoint'])
+api_errors = Counter('neetiq_telegram_api_errors_total', 'Telegram Bot API calls that failed', ['endpoint'])
+api_retry_after = Counter('neetiq_telegram_retry_after_total', 'RetryAfter (flood control) responses', ['endpoint'])
+job_seconds = Histogram('neetiq_job_seconds', 'Fan-out job duration', ['job'], buckets=JOB_BUCKETS)
+job_deliveries = Counter('neetiq_job_deliveries_total', 'Fan-out deliveries per job and outcome', ['job', 'outcome'])
+
+
+def timed(name, callback):
+    """Wraps a handler coroutine so its latency and failures are recorded under `name`."""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+    return wrapper
+
+def record_job(job, started, sent=0, failed=0):
+    """Records one fan-out run that began at time.monotonic() == started."""
+    job_seconds.observe(time.monotonic() - started, job)
+    if sent:
+        job_deliveries.inc(job, 'sent', amount=sent)
+    if failed:
+        job_deliveries.inc(job, 'failed', amount=failed)
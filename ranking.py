@@ -0,0 +1,69 @@
+from sortedcontainers import SortedList
+
+# --- RANK INDEX ---
+class RankIndex:
+    """
+    Order-statistic index over user scores.
+    Rank follows the leaderboard rule: 1 + number of users with a strictly higher score.
+    Lookups and updates are O(log n).
+    """
+    def __init__(self, pairs=()):
+        self._scores = {}             # user_id -> score
+        self._sorted = SortedList()   # every score, duplicates included
+        self.load(pairs)
+
+    def load(self, pairs):
+        """Replaces the index with (user_id, score) pairs."""
+        self._scores = {user_id: score or 0 for user_id, score in pairs}
+        self._sorted = SortedList(self._scores.values())
+
+    def add(self, user_id, delta):
+        """Applies a score change; unknown users start from 0."""
+        old = self._scores.get(user_id)
+        if old is None:
+            new = delta
+        else:
+            self._sorted.remove(old)
+            new = old + delta
+        self._scores[user_id] = new
+        self._sorted.add(new)
+
+    def score_of(self, user_id):
+        return self._scores.get(user_id)
+
+    def rank_for_score(self, score):
+        return len(self._sorted) - self._sorted.bisect_right(score) + 1
+
+    def rank_of(self, user_id):
+        """Rank of a user, or None if they have no score here."""
+        score = self._scores.get(user_id)
+        return None if score is None else self.rank_for_score(score)
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class GroupRanks:
+    """One RankIndex per group chat."""
+    def __init__(self):
+        self._groups = {}  # chat_id -> RankIndex
+
+    def load(self, rows):
+        """Replaces every group index from (chat_id, user_id, score) rows."""
+        pairs = {}
+        for chat_id, user_id, score in rows:
+            pairs.setdefault(chat_id, []).append((user_id, score))
+        self._groups = {chat_id: RankIndex(p) for chat_id, p in pairs.items()}
+
+    def add(self, chat_id, user_id, delta):
+        index = self._groups.get(chat_id)
+        if index is None:
+            index = self._groups[chat_id] = RankIndex()
+        index.add(user_id, delta)
+
+    def rank_of(self, chat_id, user_id):
+        index = self._groups.get(chat_id)
+        return None if index is None else index.rank_of(user_id)
+
+    def __len__(self):
+        return len(self._groups)
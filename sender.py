@@ -0,0 +1,253 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- PRIORITY LANES ---
+# Pass one of these as `rate_limit_args=` to any context.bot.* call (lower goes first).
+# Calls without it (reply_text, answer, ...) are treated as INTERACTIVE.
+INTERACTIVE = 0   # direct replies to a user command
+JOBS = 1          # scheduled per-group traffic (auto quiz, nightly leaderboard)
+BULK = 2          # broadcast and mirror fan-out
+LANES = {INTERACTIVE: 'interactive', JOBS: 'jobs', BULK: 'bulk'}
+
+# --- LIMITS (Telegram: ~30 msg/s overall, ~20 msg/min per group, ~1 msg/s per private chat) ---
+SEND_GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "30"))            # msg/s
+SEND_GROUP_PER_MINUTE = float(os.environ.get("SEND_GROUP_PER_MINUTE", "20"))  # msg/min per group
+SEND_PRIVATE_RATE = float(os.environ.get("SEND_PRIVATE_RATE", "1"))           # msg/s per private chat
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", "3"))
+
+# Endpoints that post into a chat and therefore count against that chat's limit
+CHAT_SEND_ENDPOINTS = {'copyMessage', 'copyMessages', 'forwardMessage', 'forwardMessages'}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Seconds until one token is available (0 if it is available now)."""
+        now = now or time.monotonic()
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    @property
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class PrioritySendScheduler(BaseRateLimiter):
+    """
+    Single outbound gate for every Bot API call of the application.
+    - per-chat buckets (groups ~20/min, private chats ~1/s) for message-sending endpoints,
+      whose waiters are also served by priority lane
+    - one global token bucket (~30/s) granted strictly by priority lane
+    - RetryAfter pauses ALL sending for the requested time and retries the call
+    """
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, group_per_minute=SEND_GROUP_PER_MINUTE,
+                 private_rate=SEND_PRIVATE_RATE, max_retries=SEND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_per_minute / 60
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self._chat_buckets = {}   # chat_id -> TokenBucket
+        self._chat_waiters = {}   # chat_id -> heap of (lane, seq, future) waiting for that chat's bucket
+        self._chat_pumps = set()  # one task per chat with waiters
+        self._seq = itertools.count()
+        self._lanes = {lane: deque() for lane in LANES}  # futures waiting for a global token
+        self._wakeup = None
+        self._dispatcher = None
+        self._paused_until = 0.0
+        self._sent_times = deque()  # monotonic timestamps of the last minute of requests
+        self.counters = {'requests': 0, 'retry_after': 0, 'retry_after_seconds': 0.0, 'errors': 0, 'given_up': 0}
+
+    async def initialize(self):
+        self._ensure_dispatcher()
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in list(self._chat_pumps):
+            task.cancel()
+
+    def has_capacity(self, chat_id):
+        """True if a send to chat_id would go out without waiting for the chat's bucket."""
+        return not self._chat_waiters.get(chat_id) and self._chat_bucket(chat_id).delay() == 0
+
+    # ---------------- internals ----------------
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Full buckets carry no state worth keeping
+                for cid in [c for c, b in self._chat_buckets.items() if b.is_full]:
+                    del self._chat_buckets[cid]
+            is_group = str(chat_id).startswith('-') or str(chat_id).startswith('@')
+            rate = self.group_rate if is_group else self.private_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, max(1.0, rate * 60) if is_group else 1.0)
+        return bucket
+
+    async def _dispatch(self):
+        """Hands out global tokens to the highest-priority waiter."""
+        while True:
+            if not any(self._lanes.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            wait = max(self.global_bucket.delay(now), self._paused_until - now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            future = self._next_waiter()
+            if future is not None:
+                self.global_bucket.take()
+                future.set_result(None)
+
+    def _next_waiter(self):
+        """Oldest still-pending waiter of the highest-priority non-empty lane."""
+        for lane in sorted(self._lanes):
+            queue = self._lanes[lane]
+            while queue:
+                future = queue.popleft()
+                if not future.done():  # skip callers that were cancelled while waiting
+                    return future
+        return None
+
+    async def _acquire_chat(self, priority, chat_id):
+        """Takes a token from the chat's bucket; when it is empty, waiters queue by lane."""
+        bucket = self._chat_bucket(chat_id)
+        waiters = self._chat_waiters.get(chat_id)
+        if not waiters and bucket.delay() == 0:
+            bucket.take()
+            return
+        if waiters is None:
+            waiters = self._chat_waiters[chat_id] = []
+            task = asyncio.create_task(self._pump_chat(chat_id, bucket, waiters))
+            self._chat_pumps.add(task)
+            task.add_done_callback(self._chat_pumps.discard)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(waiters, (priority, next(self._seq), future))
+        await future
+
+    async def _pump_chat(self, chat_id, bucket, waiters):
+        """Grants the chat's tokens as they refill, highest-priority (then oldest) waiter first."""
+        try:
+            while waiters:
+                if waiters[0][2].done():  # cancelled while waiting
+                    heapq.heappop(waiters)
+                    continue
+                wait = bucket.delay()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                _, _, future = heapq.heappop(waiters)
+                bucket.take()
+                future.set_result(None)
+        finally:
+            if self._chat_waiters.get(chat_id) is waiters:
+                del self._chat_waiters[chat_id]
+            for _, _, future in waiters:
+                future.cancel()
+
+    async def _acquire(self, priority, chat_id):
+        if chat_id is not None:
+            await self._acquire_chat(priority, chat_id)
+
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        self._lanes.get(priority, self._lanes[BULK]).append(future)
+        self._wakeup.set()
+        await future
+
+    def _record_sent(self):
+        now = time.monotonic()
+        self._sent_times.append(now)
+        while self._sent_times and now - self._sent_times[0] > 60:
+            self._sent_times.popleft()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = INTERACTIVE if rate_limit_args is None else rate_limit_args
+        is_chat_send = endpoint.startswith('send') or endpoint in CHAT_SEND_ENDPOINTS
+        chat_id = data.get('chat_id') if is_chat_send else None
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, chat_id)
+            self.counters['requests'] += 1
+            self._record_sent()
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+                self.counters['retry_after'] += 1
+                metrics.api_retry_after.inc(endpoint)
+                self.counters['retry_after_seconds'] += delay
+                # Flood control is enforced per bot, so everyone waits
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning(f"RetryAfter on {endpoint}: pausing sends for {delay:.1f}s")
+                if attempt == self.max_retries:
+                    self.counters['given_up'] += 1
+                    raise
+            except Exception:
+                self.counters['errors'] += 1
+                metrics.api_errors.inc(endpoint)
+                raise
+            finally:
+                # Latency of the HTTP call itself; time spent waiting for a token is not included
+                metrics.api_seconds.observe(time.perf_counter() - start, endpoint)
+
+    # ---------------- observability ----------------
+
+    def stats(self):
+        now = time.monotonic()
+        recent = sum(1 for t in self._sent_times if now - t <= 60)
+        return {
+            **self.counters,
+            'queue_depth': {name: len(self._lanes[lane]) for lane, name in LANES.items()},
+            'throughput_per_s': recent / 60,
+            'paused_for_s': max(0.0, self._paused_until - now),
+            'chat_buckets': len(self._chat_buckets),
+            'chat_waiters': sum(len(w) for w in self._chat_waiters.values()),
+        }
+
+
+send_scheduler = PrioritySendScheduler()
+
+metrics.gauge('neetiq_send_queue_depth', 'Calls waiting for a global send token, per lane',
+              lambda: {(name,): depth for name, depth in send_scheduler.stats()['queue_depth'].items()}, ['lane'])
+metrics.gauge('neetiq_send_chat_buckets', 'Per-chat rate buckets held in memory',
+              lambda: {(): send_scheduler.stats()['chat_buckets']})
+metrics.gauge('neetiq_send_paused_seconds', 'Remaining flood-control pause',
+              lambda: {(): send_scheduler.stats()['paused_for_s']})
+metrics.stats_gauge('neetiq_send_scheduler', 'Send scheduler counters and throughput (requests/s over the last minute)',
+                    send_scheduler.stats)
@@ -0,0 +1,152 @@
+import os
+import re
+import sqlite3
+import threading
+
+# --- STORAGE BACKENDS ---
+# database.py talks to storage through a small "pool" contract so Turso and a local
+# SQLite file are interchangeable:
+#   acquire() -> client, release(client), discard(client), close(), stats()
+#   is_sql_error(exc): True for "bad statement" (client reusable), not "broken connection"
+# A client has execute(sql, params) and batch([(sql, params), ...]) returning result
+# sets with .columns, .rows and .rows_affected; a batch is one transaction.
+# ClientPool in database.py is the Turso backend; SQLiteBackend below is the local one.
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "neetiq.db")
+# Prepared statements kept per connection (sqlite3 reuses them by SQL text)
+SQLITE_STATEMENT_CACHE = int(os.environ.get("SQLITE_STATEMENT_CACHE", "512"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Statements that can run on a read-only connection
+_READ_ONLY = re.compile(r"^\s*(SELECT|PRAGMA\s+table_info|EXPLAIN)\b", re.IGNORECASE)
+_WRITE_KEYWORD = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+class ResultSet:
+    __slots__ = ('columns', 'rows', 'rows_affected')
+
+    def __init__(self, columns, rows, rows_affected):
+        self.columns = columns
+        self.rows = rows
+        self.rows_affected = rows_affected
+
+
+def is_read(sql):
+    """True for statements a read-only connection can run (anything unsure counts as a write)."""
+    if _READ_ONLY.match(sql):
+        return not _WRITE_KEYWORD.search(sql)
+    if sql.lstrip()[:4].upper() == 'WITH':
+        return not _WRITE_KEYWORD.search(sql)
+    return False
+
+
+class SQLiteClient:
+    """Routes reads to the calling thread's reader connection and writes to the shared writer."""
+    closed = False
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _run(conn, sql, params):
+        cursor = conn.execute(sql, tuple(params))
+        rows = cursor.fetchall()
+        columns = tuple(d[0] for d in cursor.description or ())
+        return ResultSet(columns, rows, cursor.rowcount)
+
+    def execute(self, sql, params=()):
+        if is_read(sql):
+            self.backend.counters['reads'] += 1
+            return self._run(self.backend.reader(), sql, params)
+        with self.backend.write_lock:
+            self.backend.counters['writes'] += 1
+            return self._run(self.backend.writer, sql, params)
+
+    def batch(self, statements):
+        """All-read batches run in one read transaction (a consistent snapshot), others in one write transaction."""
+        if all(is_read(sql) for sql, _ in statements):
+            self.backend.counters['reads'] += 1
+            return self._transaction(self.backend.reader(), "BEGIN", statements)
+        with self.backend.write_lock:
+            self.backend.counters['writes'] += 1
+            return self._transaction(self.backend.writer, "BEGIN IMMEDIATE", statements)
+
+    def _transaction(self, conn, begin, statements):
+        conn.execute(begin)
+        try:
+            results = [self._run(conn, sql, params) for sql, params in statements]
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return results
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Local SQLite file in WAL mode: readers never block the writer or each other.
+    One writer connection behind a lock (SQLite allows a single writer anyway) and
+    one reader connection per worker thread, each with its own statement cache.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.counters = {'reads': 0, 'writes': 0, 'readers_opened': 0}
+        # The writer opens (and if needed creates) the file and switches it to WAL first
+        self.writer = self._connect()
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+        self.in_use = 0
+
+    def _connect(self, read_only=False):
+        target = f"file:{self.path}?mode=ro" if read_only else f"file:{self.path}"
+        conn = sqlite3.connect(target, uri=True, isolation_level=None, check_same_thread=False,
+                               cached_statements=SQLITE_STATEMENT_CACHE)
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect(read_only=True)
+            with self._readers_lock:
+                self._readers.append(conn)
+            self.counters['readers_opened'] += 1
+        return conn
+
+    # ---------------- pool contract ----------------
+
+    def is_sql_error(self, exc):
+        return isinstance(exc, sqlite3.Error)
+
+    def acquire(self):
+        with self._lock:
+            self.in_use += 1
+        return SQLiteClient(self)
+
+    def release(self, client):
+        with self._lock:
+            self.in_use -= 1
+
+    def discard(self, client):
+        # Nothing to reconnect: the connections are local files
+        self.release(client)
+
+    def close(self):
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self.writer.close()
+
+    def stats(self):
+        return {**self.counters, 'in_use': self.in_use, 'idle': len(self._readers), 'backend': 'sqlite'}
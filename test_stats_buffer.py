@@ -0,0 +1,96 @@
+"""
+Randomized check of StatsBuffer's streak folding against the original per-answer rule:
+a correct answer extends current_streak (and max_streak when it passes it), a wrong
+one resets it. Flushes happen at random points, and some of them fail so the snapshot
+is folded back in front of newer answers (StreakDelta.prepend) and retried.
+
+Run with: python -m pytest -q test_stats_buffer.py
+"""
+import contextlib
+import os
+import random
+import tempfile
+
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'stats_buffer_test.db'))
+
+import pytest  # noqa: E402
+
+import database  # noqa: E402
+
+
+class Model:
+    """The per-answer UPDATE the buffer replaced, kept in memory."""
+
+    def __init__(self):
+        self.stats = {}   # user_id -> [attempted, correct, score, current_streak, max_streak]
+        self.groups = {}  # (chat_id, user_id) -> [attempted, correct, score]
+
+    def answer(self, user_id, chat_id, is_correct):
+        row = self.stats.setdefault(user_id, [0, 0, 0, 0, 0])
+        row[0] += 1
+        if is_correct:
+            row[1] += 1
+            row[2] += 4
+            row[3] += 1
+            row[4] = max(row[4], row[3])
+        else:
+            row[2] -= 1
+            row[3] = 0
+        group = self.groups.setdefault((chat_id, user_id), [0, 0, 0])
+        group[0] += 1
+        group[1] += 1 if is_correct else 0
+        group[2] += 4 if is_correct else -1
+
+
+def stored(user_ids):
+    with database.get_db() as conn:
+        conn.execute("SELECT user_id, attempted, correct, score, current_streak, max_streak FROM stats")
+        stats = {row[0]: list(row[1:]) for row in conn.fetchall() if row[0] in user_ids}
+        conn.execute("SELECT chat_id, user_id, attempted, correct, score FROM group_stats")
+        groups = {(row[0], row[1]): list(row[2:]) for row in conn.fetchall() if row[1] in user_ids}
+    return stats, groups
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_streaks_match_per_answer_updates(monkeypatch, seed):
+    database.init_db()
+    rng = random.Random(seed)
+    user_ids = set(range(900000 + seed * 100, 900000 + seed * 100 + 6))
+    chats = [-1001, -1002]
+    model = Model()
+    buffer = database.StatsBuffer(flush_size=10 ** 9)
+
+    def answer():
+        user_id = rng.choice(sorted(user_ids))
+        chat_id = rng.choice(chats)
+        # Mostly-correct users build streaks that span several flushes
+        is_correct = rng.random() < (0.9 if user_id % 2 else 0.6)
+        buffer.record(user_id, chat_id, is_correct, username=f"u{user_id}", day="2026-01-01")
+        model.answer(user_id, chat_id, is_correct)
+
+    @contextlib.contextmanager
+    def broken_db(fresh=True):
+        # Answers keep arriving while the flush is in flight, then the write fails
+        for _ in range(rng.randrange(20)):
+            answer()
+        raise ConnectionError("simulated outage")
+        yield
+
+    for step in range(2000):
+        answer()
+        roll = rng.random()
+        if roll < 0.05:
+            with monkeypatch.context() as patch:
+                patch.setattr(database, 'get_db', broken_db)
+                try:
+                    buffer.flush()
+                except ConnectionError:
+                    pass
+        elif roll < 0.08:
+            buffer.flush()
+            assert stored(user_ids) == (model.stats, model.groups), f"diverged at answer {step}"
+
+    buffer.flush()
+    assert buffer.stats()['pending'] == 0
+    assert stored(user_ids) == (model.stats, model.groups)
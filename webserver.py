@@ -0,0 +1,189 @@
+"""
+Minimal HTTP/1.1 server that runs on the bot's own event loop.
+
+In webhook mode it receives Telegram updates and answers Render health pings,
+so no extra thread or web framework is needed. To try it locally, start the bot
+with WEBHOOK_MODE=1 and a fixed WEBHOOK_SECRET (leave WEBHOOK_URL empty so
+nothing is registered with Telegram), then post a recorded update with the
+same WEBHOOK_SECRET in the environment:
+    python webserver.py post update.json [http://127.0.0.1:8080/telegram]
+"""
+import os
+import sys
+import hmac
+import json
+import asyncio
+import logging
+import secrets
+from telegram import Update
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- WEBHOOK CONFIGURATION ---
+WEBHOOK_MODE = os.environ.get("WEBHOOK_MODE", "0") == "1"
+# Public base URL Telegram should call (e.g. https://neetiq.onrender.com); empty = don't register
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# Echoed by Telegram in X-Telegram-Bot-Api-Secret-Token; random per process when not set
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 8080))
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+KEEP_ALIVE_SECONDS = 75
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class BadRequestError(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class WebhookServer:
+    """
+    Routes are (method, path) -> async handler(headers, body) returning
+    (status, content_type, body bytes). Every connection runs as its own task
+    and is kept alive, so Telegram can deliver updates in parallel.
+    """
+    def __init__(self, application, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.application = application
+        metrics.gauge('neetiq_update_queue_size', 'Updates received but not yet handled',
+                      lambda: {(): application.update_queue.qsize()})
+        self.secret = secret
+        self.routes = {
+            ('GET', '/'): self.home,
+            ('HEAD', '/'): self.home,
+            ('GET', '/metrics'): self.metrics_route,
+            ('POST', path): self.receive_update,
+        }
+        self._server = None
+        self.counters = {'requests': 0, 'updates': 0, 'rejected': 0, 'bad_requests': 0}
+
+    # ---------------- routes ----------------
+
+    async def home(self, headers, body):
+        return 200, 'text/plain; charset=utf-8', b"Bot is running!"
+
+    async def metrics_route(self, headers, body):
+        return 200, metrics.CONTENT_TYPE, metrics.render().encode()
+
+    async def receive_update(self, headers, body):
+        token = headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.counters['rejected'] += 1
+            return 403, 'text/plain', b"forbidden"
+        try:
+            payload = json.loads(body)
+            if not isinstance(payload, dict):
+                raise TypeError("update must be a JSON object")
+            update = Update.de_json(payload, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            self.counters['bad_requests'] += 1
+            return 400, 'text/plain', b"bad update"
+        # Handlers run from the application's queue; Telegram only needs the 200
+        await self.application.update_queue.put(update)
+        self.counters['updates'] += 1
+        return 200, 'text/plain', b"ok"
+
+    # ---------------- HTTP ----------------
+
+    async def _read_request(self, reader):
+        """(method, path, headers, body) of the next request on the connection."""
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_SECONDS)
+        if len(head) > MAX_HEADER_BYTES:
+            raise BadRequestError(413)
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise BadRequestError(400)
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequestError(400)
+        if length < 0:
+            raise BadRequestError(400)
+        if length > MAX_BODY_BYTES:
+            raise BadRequestError(413)
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], headers, body
+
+    async def _respond(self, writer, status, content_type, body, keep_alive):
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    method, path, headers, body = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except (BadRequestError, asyncio.LimitOverrunError) as e:
+                    status = e.status if isinstance(e, BadRequestError) else 413
+                    return await self._respond(writer, status, 'text/plain', b"", keep_alive=False)
+
+                self.counters['requests'] += 1
+                route = self.routes.get((method, path))
+                if route is None:
+                    known_path = any(p == path for _, p in self.routes)
+                    status, content_type, payload = (405 if known_path else 404), 'text/plain', b""
+                else:
+                    try:
+                        status, content_type, payload = await route(headers, body)
+                    except Exception as e:
+                        logger.error(f"Webhook route {method} {path} failed: {e}")
+                        status, content_type, payload = 500, 'text/plain', b""
+                if method == 'HEAD':
+                    payload = b""
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=WEBHOOK_HOST, port=PORT):
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES)
+        print(f"🌐 Webhook server listening on {host}:{port}")
+        return self._server
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+def post_recorded_update(path, url=None):
+    """Posts a recorded update (JSON file) to a running webhook server, for local testing."""
+    import httpx
+    url = url or f"http://127.0.0.1:{PORT}{WEBHOOK_PATH}"
+    with open(path, encoding='utf-8') as f:
+        payload = f.read()
+    response = httpx.post(url, content=payload, headers={
+        'Content-Type': 'application/json',
+        'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET,
+    })
+    print(f"{response.status_code} {response.text}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "post":
+        sys.exit("Usage: python webserver.py post <update.json> [url]   (uses WEBHOOK_SECRET from the environment)")
+    post_recorded_update(sys.argv[2], *sys.argv[3:4])